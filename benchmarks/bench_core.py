@@ -0,0 +1,284 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import time
+from datetime import datetime
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import numpy as np
+import networkx as nx
+
+from traffic_sim.core import Agent, TrafficLightController, offset_position, gen_graph
+from traffic_sim.simulation import Simulation
+from traffic_sim.routing import Router
+
+MODES = ['grid', 'random', 'pre_defined', 'ring_road']
+
+# Numero di nodi per modalità ('grid' = righe/colonne, 'pre_defined' ha dimensione fissa)
+NODE_SWEEP = {
+    'grid': [5, 10, 20],
+    'random': [25, 50, 100],
+    'pre_defined': [29],
+    'ring_road': [25, 50, 100],
+}
+AGENT_SWEEP = [10, 100, 1000]
+
+QUICK_NODE_SWEEP = {
+    'grid': [5, 10],
+    'random': [25, 50],
+    'pre_defined': [29],
+    'ring_road': [25, 50],
+}
+QUICK_AGENT_SWEEP = [10, 100]
+
+# Pianificazione in blocco verso pochi punti di interesse: griglie e richieste per destinazione
+ROUTE_MANY_NODES = [30, 100]
+QUICK_ROUTE_MANY_NODES = [30]
+ROUTE_MANY_PER_TARGET = [2, 5, 10, 20, 40]
+ROUTE_MANY_PAIRS = 400 # richieste per caso, divise tra 400 // richieste per destinazione destinazioni
+
+# Creazione in blocco di molti agenti su una griglia grande: (righe/colonne, agenti)
+SPAWN_CASES = [(100, 10000)]
+QUICK_SPAWN_CASES = [(50, 2000)]
+
+DT = 1 / 60
+
+def _seed(seed):
+    random.seed(seed)
+    np.random.seed(seed)
+
+# Tempo medio per chiamata: migliore di repeat misure da number chiamate
+def _timeit(fn, number, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+def _result(name, mode, nodes, agents, per_call, calls):
+    return {
+        'name': name,
+        'mode': mode,
+        'nodes': nodes,
+        'agents': agents,
+        'per_call_s': per_call,
+        'calls_per_s': 1 / per_call if per_call > 0 else None,
+        'calls': calls,
+    }
+
+def _make_sim(mode, nodes, agents, seed):
+    _seed(seed)
+    sim = Simulation(seed=seed)
+    sim.generate_graph(mode, nodes)
+    if agents:
+        sim.spawn_agents(agents)
+    return sim
+
+def bench_gen_graph(mode, nodes, seed):
+    def run():
+        _seed(seed)
+        gen_graph(nodes, mode, {})
+    return [_result('gen_graph', mode, nodes, 0, _timeit(run, 3), 3)]
+
+def bench_offset_position(seed):
+    _seed(seed)
+    points = [((random.uniform(0, 1000), random.uniform(0, 1000)),
+               (random.uniform(0, 1000), random.uniform(0, 1000))) for _ in range(1000)]
+    def run():
+        for p1, p2 in points:
+            offset_position(p1, p2, side="right")
+    return [_result('offset_position', None, 0, 0, _timeit(run, 10) / len(points), 10 * len(points))]
+
+def bench_new_path(mode, nodes, seed):
+    sim = _make_sim(mode, nodes, 0, seed)
+    results = []
+    for name, router in (('Agent.new_path', None), ('Agent.new_path[router]', sim.router)):
+        _seed(seed)
+        agent = Agent((255, 0, 0), sim.graph, sim.pos, sim.lock, sim.shared_data, speed=80,
+                      store=sim.store, router=router)
+        results.append(_result(name, mode, nodes, 1, _timeit(lambda: agent.new_path(sim.graph, sim.pos), 50), 50))
+    return results
+
+def bench_agents(mode, nodes, agents, seed):
+    results = []
+    ticks = max(5, 2000 // agents)
+
+    # creazione in blocco degli agenti (grafo e router nuovi a ogni ripetizione)
+    spawn_time = float('inf')
+    for _ in range(3):
+        sim = _make_sim(mode, nodes, 0, seed)
+        start = time.perf_counter()
+        sim.spawn_agents(agents)
+        spawn_time = min(spawn_time, time.perf_counter() - start)
+    results.append(_result('Simulation.spawn_agents', mode, nodes, agents, spawn_time / agents, agents))
+
+    # percorso scalare per oggetto: Agent.update -> Agent.move_towards
+    sim = _make_sim(mode, nodes, agents, seed)
+    def update_all():
+        for agent in sim.agents:
+            agent.update(sim.graph, sim.pos, sim.agents, DT, sim.traffic_lights)
+    results.append(_result('Agent.update', mode, nodes, agents, _timeit(update_all, ticks) / agents, ticks * agents))
+
+    sim = _make_sim(mode, nodes, agents, seed)
+    movers = [agent for agent in sim.agents if agent.current_target is not None]
+    def move_all():
+        for agent in movers:
+            agent.move_towards(agent.current_target, sim.agents, sim.traffic_lights, DT)
+    if movers:
+        results.append(_result('Agent.move_towards', mode, nodes, agents,
+                               _timeit(move_all, ticks) / len(movers), ticks * len(movers)))
+
+    # passaggio vettoriale del motore
+    sim = _make_sim(mode, nodes, agents, seed)
+    results.append(_result('Simulation.step', mode, nodes, agents,
+                           _timeit(lambda: sim.step(DT), ticks) / agents, ticks * agents))
+
+    # semafori: contatori di occupazione e scansione completa degli agenti
+    if sim.traffic_lights:
+        lights = list(sim.traffic_lights.values())
+        def update_lights():
+            sim.occupancy.update(sim.store)
+            for tl in lights:
+                tl.update(DT, sim.agents, sim.pos)
+        results.append(_result('TrafficLightController.update', mode, nodes, agents,
+                               _timeit(update_lights, ticks) / len(lights), ticks * len(lights)))
+
+        def update_signals():
+            sim.occupancy.update(sim.store)
+            sim.signals.update(sim.sim_time)
+            sim.sim_time += DT
+        results.append(_result('SignalScheduler.update', mode, nodes, agents,
+                               _timeit(update_signals, ticks) / len(lights), ticks * len(lights)))
+
+        scan_lights = [TrafficLightController(tl.node, tl.incoming_edges, tl.green_time, tl.red_time,
+                                              tl.detection_radius, tl.type) for tl in lights]
+        def update_scan():
+            for tl in scan_lights:
+                tl.update(DT, sim.agents, sim.pos)
+        scan_ticks = max(1, ticks // 10)
+        results.append(_result('TrafficLightController.update[scan]', mode, nodes, agents,
+                               _timeit(update_scan, scan_ticks, repeat=1) / len(lights), scan_ticks * len(lights)))
+    return results
+
+# route_many con la soglia di default e con sole ricerche puntuali, a parità di richieste
+def bench_route_many(nodes, per_target, seed):
+    sim = _make_sim('grid', nodes, 0, seed)
+    _seed(seed)
+    targets = random.sample(list(sim.graph.nodes), ROUTE_MANY_PAIRS // per_target)
+    pairs = [(random.choice(list(sim.graph.nodes)), t) for t in targets for _ in range(per_target)]
+    results = []
+    for name, min_group in (('Router.route_many', None), ('Router.route_many[point]', len(pairs) + 1)):
+        def run():
+            Router(sim.graph).route_many(pairs, min_group=min_group)
+        results.append(_result(f"{name}[{per_target}/dest]", 'grid', nodes, 0, _timeit(run, 1, repeat=1) / len(pairs), len(pairs)))
+    return results
+
+# Una sola creazione in blocco (grafo e router nuovi, landmark compresi nella generazione)
+def bench_spawn(nodes, agents, seed):
+    sim = _make_sim('grid', nodes, 0, seed)
+    start = time.perf_counter()
+    sim.spawn_agents(agents)
+    elapsed = time.perf_counter() - start
+    return [_result(f"Simulation.spawn_agents[{sim.router.backend}]", 'grid', nodes, agents, elapsed / agents, agents)]
+
+def run_suite(seed=0, quick=False, modes=MODES, log=print):
+    node_sweep = QUICK_NODE_SWEEP if quick else NODE_SWEEP
+    agent_sweep = QUICK_AGENT_SWEEP if quick else AGENT_SWEEP
+    results = []
+    cases = [('offset_position', None, None, None)]
+    for mode in modes:
+        for nodes in node_sweep[mode]:
+            cases.append(('gen_graph', mode, nodes, None))
+            cases.append(('new_path', mode, nodes, None))
+            for agents in agent_sweep:
+                cases.append(('agents', mode, nodes, agents))
+    if 'grid' in modes:
+        for nodes in (QUICK_ROUTE_MANY_NODES if quick else ROUTE_MANY_NODES):
+            for per_target in ROUTE_MANY_PER_TARGET:
+                cases.append(('route_many', 'grid', nodes, per_target))
+        for nodes, agents in (QUICK_SPAWN_CASES if quick else SPAWN_CASES):
+            cases.append(('spawn', 'grid', nodes, agents))
+
+    for kind, mode, nodes, agents in cases:
+        start = time.perf_counter()
+        # le funzioni del simulatore stampano messaggi di debug: non interessano qui
+        with contextlib.redirect_stdout(io.StringIO()):
+            if kind == 'offset_position':
+                case = bench_offset_position(seed)
+            elif kind == 'gen_graph':
+                case = bench_gen_graph(mode, nodes, seed)
+            elif kind == 'new_path':
+                case = bench_new_path(mode, nodes, seed)
+            elif kind == 'route_many':
+                case = bench_route_many(nodes, agents, seed)
+            elif kind == 'spawn':
+                case = bench_spawn(nodes, agents, seed)
+            else:
+                case = bench_agents(mode, nodes, agents, seed)
+        results.extend(case)
+        log(f"{kind:<16} mode={mode} nodes={nodes} agents={agents} ({time.perf_counter() - start:.1f} s)")
+    return results
+
+def metadata(seed, quick):
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'seed': seed,
+        'quick': quick,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'networkx': nx.__version__,
+    }
+
+def _key(result):
+    return (result['name'], result['mode'], result['nodes'], result['agents'])
+
+# Confronta due esecuzioni: rapporto tra i tempi per chiamata (>1 = più lento)
+def compare(baseline, current, threshold=1.2):
+    base = {_key(r): r for r in baseline['results']}
+    rows = []
+    for r in current['results']:
+        b = base.get(_key(r))
+        if b is None:
+            continue
+        ratio = r['per_call_s'] / b['per_call_s']
+        rows.append((ratio, r))
+    for ratio, r in sorted(rows, key=lambda x: -x[0]):
+        flag = "REGRESSIONE" if ratio > threshold else ""
+        print(f"{r['name']:<38} {str(r['mode']):<12} nodes={r['nodes']:<4} agents={r['agents']:<5} x{ratio:.2f} {flag}")
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark dei punti caldi di traffic_sim.core")
+    parser.add_argument("--seed", type=int, default=0, help="seme fisso per grafi e agenti")
+    parser.add_argument("--quick", action="store_true", help="sweep ridotto di nodi e agenti")
+    parser.add_argument("--modes", nargs="+", default=MODES, choices=MODES, help="modalità di generazione del grafo")
+    parser.add_argument("--output", default=None, help="file JSON dei risultati (default benchmarks/results/<data>.json)")
+    parser.add_argument("--compare", default=None, help="file JSON di un'esecuzione precedente da confrontare")
+    args = parser.parse_args(argv)
+
+    report = {'meta': metadata(args.seed, args.quick), 'results': run_suite(args.seed, args.quick, args.modes)}
+
+    output = args.output
+    if output is None:
+        os.makedirs(os.path.join("benchmarks", "results"), exist_ok=True)
+        output = os.path.join("benchmarks", "results", datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print("risultati salvati in", output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+    return report
+
+
+if __name__ == "__main__":
+    main()
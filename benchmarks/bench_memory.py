@@ -0,0 +1,129 @@
+import argparse
+import gc
+import json
+import math
+import os
+import random
+import tracemalloc
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import numpy as np
+
+from traffic_sim.core import Agent, offset_position
+from traffic_sim.simulation import Simulation
+
+# Layout degli agenti misurati: 'baseline' (Agent originale, tutto nel __dict__) e 'slots' (Agent attuale)
+LAYOUTS = ("baseline", "slots")
+
+# Copia dei campi dell'Agent originale (prima di AgentStore e __slots__), per il confronto
+class BaselineAgent:
+    """
+    Stessi attributi e stessi tipi dell'Agent originale: stato in un __dict__
+    per istanza, float Python per posizione e direzione, riferimenti a lock e
+    shared_data e un proprio insieme degli archi chiusi. Il percorso è una
+    lista per agente (come quella di nx.shortest_path) e lo stato è quello
+    dopo un passo di move_towards, quando i campi numerici sono float.
+    """
+    _id_agent = 0
+    def __init__(self, color, graph, pos, lock=None, shared_data=None, speed=1, radius=5, path=None):
+        self.id = BaselineAgent._id_agent
+        BaselineAgent._id_agent += 1
+        self.color = color
+        self.speed = speed
+        self.radius = radius
+        self.path = []
+        self.path_index = 0
+        self.x, self.y = 0, 0
+        self.prev_x, self.prev_y = 0, 0
+        self.actual_speed = 0
+        self.dir_x, self.dir_y = 0, 0
+        self.angle = 0
+        self.side = "right"
+        self.current_target = None
+        self.current_edge_nodes = None
+
+        self.lock = lock
+        self.shared_data = shared_data
+        self.edge_closed = set()
+
+        self.path = list(path)
+        u, v = self.path[0], self.path[1]
+        p1_off, p2_off = offset_position(pos[u], pos[v], side=self.side)
+        self.x, self.y = p1_off
+        self.current_target = p2_off
+        self.current_edge_nodes = (u, v, self.side)
+        self._move(1 / 60)
+
+    # Aggiornamento dei campi come in move_towards (senza collisioni né semafori)
+    def _move(self, dt):
+        dx = self.current_target[0] - self.x
+        dy = self.current_target[1] - self.y
+        dist = math.hypot(dx, dy)
+        self.prev_x, self.prev_y = self.x, self.y
+        self.dir_x, self.dir_y = dx / dist, dy / dist
+        self.angle = math.atan2(dy, dx)
+        step = min(self.speed * 0.5 * dt, dist)
+        self.x += self.dir_x * step
+        self.y += self.dir_y * step
+        self.actual_speed = step / dt
+
+# Memoria allocata per agente: oggetto Agent, percorso e righe dell'AgentStore
+def bytes_per_agent(num_agents, mode='grid', nodes=10, seed=0, layout="slots"):
+    random.seed(seed)
+    np.random.seed(seed)
+    sim = Simulation(seed=seed)
+    sim.generate_graph(mode, nodes)
+    # percorsi calcolati prima della misura: si misura l'agente, non il router
+    paths = [sim.router.route(*pair) for pair in sim.router.random_pairs(num_agents)]
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    if layout == "baseline":
+        agents = [BaselineAgent((255, 0, 0), sim.graph, sim.pos, sim.lock, sim.shared_data, speed=80,
+                                path=path) for path in paths]
+    else:
+        agents = [Agent((255, 0, 0), sim.graph, sim.pos, sim.lock, sim.shared_data, speed=80,
+                        store=sim.store, router=sim.router, path=list(path)) for path in paths]
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    store_bytes = sum(getattr(sim.store, name).nbytes for name in vars(sim.store)
+                      if isinstance(getattr(sim.store, name), np.ndarray))
+    return {
+        'agents': len(agents),
+        'layout': layout,
+        'mode': mode,
+        'nodes': nodes,
+        'bytes_per_agent': (after - before) / num_agents,
+        'store_bytes_per_agent': store_bytes / sim.store.capacity if layout == "slots" else 0.0,
+        'has_dict': hasattr(agents[0], '__dict__'),
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Memoria occupata per agente")
+    parser.add_argument("--agents", type=int, nargs="+", default=[1000, 10000, 100000], help="numero di agenti")
+    parser.add_argument("--mode", default="grid", choices=['grid', 'random', 'pre_defined', 'ring_road'])
+    parser.add_argument("--nodes", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="file JSON dei risultati")
+    args = parser.parse_args(argv)
+
+    results = []
+    for num_agents in args.agents:
+        # prima (baseline) e dopo (slots), sullo stesso grafo e con lo stesso seme
+        for layout in LAYOUTS:
+            result = bytes_per_agent(num_agents, args.mode, args.nodes, args.seed, layout)
+            results.append(result)
+            print(f"{num_agents} agenti, {layout}: {result['bytes_per_agent']:.0f} byte/agente "
+                  f"(di cui {result['store_bytes_per_agent']:.0f} nello store), __dict__={result['has_dict']}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import argparse
+import os
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+from traffic_sim.simulation import Simulation
+from traffic_sim.parallel import compare_speedup
+from traffic_sim.scenario import save_scenario, load_scenario
+
+
+# Esecuzione batch della simulazione senza display
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulazione del traffico senza GUI")
+    parser.add_argument("--mode", default="grid", choices=['grid', 'random', 'pre_defined', 'ring_road'],
+                        help="tipo di grafo da generare")
+    parser.add_argument("--nodes", type=int, default=5, help="numero di nodi (righe/colonne per 'grid')")
+    parser.add_argument("--agents", type=int, default=100, help="numero di agenti")
+    parser.add_argument("--ticks", type=int, default=1000, help="numero di step da simulare")
+    parser.add_argument("--dt", type=float, default=1/60, help="passo di simulazione in secondi")
+    parser.add_argument("--seed", type=int, default=None, help="seme del generatore casuale")
+    parser.add_argument("--closed-mode", default="view", choices=['view', 'weight'],
+                        help="esclusione degli archi chiusi nel routing: vista filtrata o peso infinito")
+    parser.add_argument("--routing", default="auto", choices=['bfs', 'astar', 'alt', 'auto'],
+                        help="algoritmo di routing: numero di archi (bfs), lunghezza euclidea (astar, alt con landmark) "
+                             "o alt solo sui grafi grandi (auto)")
+    parser.add_argument("--regions", type=int, default=0,
+                        help="se > 1, confronta la simulazione a regioni su più processi con quella a processo singolo")
+    parser.add_argument("--layout", default="auto", choices=['auto', 'spring', 'fast'],
+                        help="layout dei grafi 'random' e 'ring_road': spring, a forze su griglia (fast) o scelto per dimensione")
+    parser.add_argument("--respawn", action="store_true",
+                        help="gli agenti arrivati a destinazione sono sostituiti da nuovi agenti (riusati dal pool)")
+    parser.add_argument("--scenario", default=None,
+                        help="carica grafo, semafori e percorsi degli agenti da un file di scenario (ignora --mode, --nodes e --agents)")
+    parser.add_argument("--save-scenario", default=None,
+                        help="salva lo scenario generato (prima della simulazione) nel file indicato")
+    args = parser.parse_args(argv)
+    router_options = {'closed_mode': args.closed_mode, 'backend': args.routing}
+
+    if args.regions > 1:
+        if args.scenario or args.save_scenario:
+            parser.error("--scenario e --save-scenario non sono supportati con --regions")
+        result = compare_speedup(args.mode, args.nodes, args.agents, args.ticks, args.regions,
+                                 seed=args.seed if args.seed is not None else 0, dt=args.dt,
+                                 router_options=router_options, layout=args.layout, respawn_on_arrival=args.respawn)
+        single, parallel = result['single'], result['parallel']
+        print(f"processo singolo: {single['wall_time']:.3f} s, {single['agent_steps_per_sec']:.0f} agent-step/s")
+        print(f"{args.regions} regioni: {parallel['wall_time']:.3f} s, {parallel['agent_steps_per_sec']:.0f} agent-step/s, "
+              f"{parallel['handoffs']} trasferimenti, agenti per regione {parallel['agents_per_region']}")
+        print(f"speedup: {result['speedup']:.2f}x")
+        return result
+
+    sim = Simulation(seed=args.seed, router_options=router_options, respawn_on_arrival=args.respawn)
+    if args.scenario:
+        load_scenario(args.scenario, sim)
+    else:
+        sim.generate_graph(args.mode, args.nodes, layout=args.layout)
+        sim.spawn_agents(args.agents)
+    if args.save_scenario:
+        save_scenario(sim, args.save_scenario)
+
+    stats = sim.run(args.ticks, dt=args.dt)
+
+    print(f"grafo '{sim.mode}': {sim.graph.number_of_nodes()} nodi, {sim.graph.number_of_edges()} archi")
+    print(f"{stats['agents']} agenti x {stats['ticks']} tick = {stats['agent_steps']} agent-step")
+    print(f"tempo simulato: {stats['sim_time']:.2f} s, tempo reale: {stats['wall_time']:.3f} s "
+          f"(x{stats['sim_rate']:.1f} rispetto al tempo reale)")
+    print(f"agent-step/s: {stats['agent_steps_per_sec']:.0f}, percorsi completati: {stats['completed_trips']}")
+    routing = stats['routing']
+    print(f"cache percorsi: {routing['hits']} hit, {routing['tree_hits']} hit da albero, "
+          f"{routing['misses']} miss (hit rate {routing['hit_rate']:.1%}), {routing['tree_builds']} alberi costruiti")
+    return stats
+
+
+if __name__ == "__main__":
+    main()
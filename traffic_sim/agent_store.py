@@ -0,0 +1,326 @@
+from array import array
+import numpy as np
+
+# Campi float dello stato degli agenti, uno per colonna (struct-of-arrays)
+FLOAT_FIELDS = ("x", "y", "prev_x", "prev_y", "speed", "actual_speed",
+                "dir_x", "dir_y", "angle", "radius", "target_x", "target_y")
+
+# Tutti gli array per riga dello store (ingranditi insieme, copiati negli snapshot)
+ROW_ARRAYS = FLOAT_FIELDS + ("path_index", "edge", "leader", "follower", "has_target", "alive")
+
+# Distanza dal nodo di arrivo entro cui l'agente si ferma col rosso
+TL_STOP_DIST = 40
+
+# Stato di tutti gli agenti in array NumPy, una riga per agente
+class AgentStore:
+    """
+    Ogni Agent è una vista su una riga di questo contenitore: gli step della
+    simulazione avanzano tutti gli agenti con un unico passaggio vettoriale.
+    Le corsie (u, v, side) sono identificate da interi (edge id) e per ognuna
+    viene mantenuta la coda ordinata degli agenti che la percorrono, come lista
+    doppiamente concatenata (leader/follower), aggiornata all'ingresso e
+    all'uscita dalla corsia.
+    """
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        self.size = 0 # righe utilizzate
+        for name in FLOAT_FIELDS:
+            setattr(self, name, np.zeros(capacity, dtype=np.float64))
+        self.path_index = np.zeros(capacity, dtype=np.int32)
+        self.edge = np.full(capacity, -1, dtype=np.int32) # id della corsia corrente
+        self.leader = np.full(capacity, -1, dtype=np.int32) # agente che precede sulla corsia
+        self.follower = np.full(capacity, -1, dtype=np.int32) # agente che segue sulla corsia
+        self.has_target = np.zeros(capacity, dtype=bool)
+        self.alive = np.zeros(capacity, dtype=bool) # riga occupata da un agente
+        self.agents = [] # riga -> Agent (None se la riga è libera)
+        self.free_rows = [] # righe liberate e riutilizzabili
+
+        self.lanes = [] # id -> (u, v, side)
+        self.lane_ids = {} # (u, v, side) -> id
+        self.edge_lanes = {} # (u, v) -> [id corsie]
+        self.lane_head = [] # id -> riga dell'agente più avanti sulla corsia
+        self.lane_tail = [] # id -> riga dell'ultimo agente entrato
+        self.lane_open = np.ones(16, dtype=bool)
+
+        # arco (u, v) -> righe degli agenti il cui percorso lo usa, come array di interi a 32 bit.
+        # Le voci non vengono rimosse quando un percorso cambia (sono filtrate da
+        # rows_on_route): l'indice viene ricostruito quando le voci obsolete
+        # superano quelle valide.
+        self.edge_rows = {}
+        self._route_entries = 0 # voci presenti nell'indice
+        self._live_entries = 0 # voci dei percorsi attuali
+
+    # Riserva una riga per un nuovo agente
+    def add(self, agent):
+        if self.free_rows:
+            row = self.free_rows.pop()
+            self.agents[row] = agent
+        else:
+            if self.size == self.capacity:
+                self._grow(self.capacity * 2)
+            row = self.size
+            self.size += 1
+            self.agents.append(agent)
+        self.alive[row] = True
+        return row
+
+    # Libera la riga di un agente rimosso dalla simulazione
+    def remove(self, row):
+        agent = self.agents[row]
+        self.set_lane(row, -1)
+        self.index_route(row, agent.path, [])
+        self.has_target[row] = False
+        self.alive[row] = False
+        self.actual_speed[row] = 0
+        self.agents[row] = None
+        self.free_rows.append(row)
+
+    # Garantisce spazio per almeno num_rows righe senza riallocare durante gli inserimenti
+    def reserve(self, num_rows):
+        if num_rows > self.capacity:
+            capacity = self.capacity
+            while capacity < num_rows:
+                capacity *= 2
+            self._grow(capacity)
+
+    def _grow(self, capacity):
+        for name in ROW_ARRAYS:
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self.capacity] = old
+            setattr(self, name, new)
+        for name in ("edge", "leader", "follower"):
+            getattr(self, name)[self.capacity:] = -1
+        self.capacity = capacity
+
+    # Restituisce (creandolo se serve) l'id intero della corsia
+    def lane_id(self, lane):
+        lid = self.lane_ids.get(lane)
+        if lid is None:
+            lid = len(self.lanes)
+            self.lanes.append(lane)
+            self.lane_ids[lane] = lid
+            self.edge_lanes.setdefault(lane[:2], []).append(lid)
+            self.lane_head.append(-1)
+            self.lane_tail.append(-1)
+            if lid == len(self.lane_open):
+                self.lane_open = np.concatenate((self.lane_open, np.ones(lid, dtype=bool)))
+            self.lane_open[lid] = True
+        return lid
+
+    # Sposta la riga sulla corsia lid (-1 = nessuna corsia), in coda agli agenti presenti
+    def set_lane(self, row, lid):
+        old = self.edge[row]
+        if old >= 0:
+            self._unlink(row, old)
+        self.edge[row] = lid
+        if lid >= 0:
+            tail = self.lane_tail[lid]
+            self.leader[row] = tail
+            self.follower[row] = -1
+            if tail >= 0:
+                self.follower[tail] = row
+            else:
+                self.lane_head[lid] = row
+            self.lane_tail[lid] = row
+
+    def _unlink(self, row, lid):
+        lead, foll = self.leader[row], self.follower[row]
+        if lead >= 0:
+            self.follower[lead] = foll
+        else:
+            self.lane_head[lid] = foll
+        if foll >= 0:
+            self.leader[foll] = lead
+        else:
+            self.lane_tail[lid] = lead
+        self.leader[row] = -1
+        self.follower[row] = -1
+
+    # Agenti sulla corsia, dal più avanzato all'ultimo entrato
+    def lane_rows(self, lid):
+        rows = []
+        row = self.lane_head[lid]
+        while row >= 0:
+            rows.append(row)
+            row = self.follower[row]
+        return rows
+
+    # Aggiorna l'indice arco -> agenti quando il percorso di una riga cambia
+    def index_route(self, row, old_path, new_path):
+        self._live_entries += max(len(new_path) - 1, 0) - max(len(old_path) - 1, 0)
+        self._add_route(row, new_path)
+        if self._route_entries > 2 * self._live_entries + 1024:
+            self._rebuild_route_index()
+
+    def _add_route(self, row, path):
+        for edge in zip(path, path[1:]):
+            rows = self.edge_rows.get(edge)
+            if rows is None:
+                rows = self.edge_rows[edge] = array("i")
+            rows.append(row)
+        self._route_entries += max(len(path) - 1, 0)
+
+    # Ricostruisce l'indice dai percorsi attuali, eliminando le voci obsolete
+    def _rebuild_route_index(self):
+        self.edge_rows = {}
+        self._route_entries = 0
+        for row, agent in enumerate(self.agents):
+            if agent is not None and self.alive[row]:
+                self._add_route(row, agent.path)
+        self._live_entries = self._route_entries
+
+    # Righe il cui percorso ancora da compiere attraversa l'arco (u, v) in una delle due direzioni
+    def rows_on_route(self, u, v):
+        candidates = set(self.edge_rows.get((u, v), ())) | set(self.edge_rows.get((v, u), ()))
+        rows = []
+        for row in candidates:
+            if not self.alive[row]:
+                continue
+            path = self.agents[row].path
+            remaining = path[self.path_index[row]:]
+            for a, b in zip(remaining, remaining[1:]):
+                if (a, b) == (u, v) or (a, b) == (v, u):
+                    rows.append(row)
+                    break
+        return sorted(rows)
+
+    # Copia dello stato di righe e corsie (usata da Simulation.snapshot)
+    def snapshot(self):
+        """
+        Gli array sono copiati in blocco; le liste delle righe e delle code
+        sono copie superficiali. L'indice arco -> agenti non viene copiato:
+        dipende solo dai percorsi e viene ricostruito da restore.
+        """
+        return {
+            'arrays': {name: getattr(self, name).copy() for name in ROW_ARRAYS},
+            'capacity': self.capacity,
+            'size': self.size,
+            'agents': list(self.agents),
+            'free_rows': list(self.free_rows),
+            'lanes': self.lanes[:], # le corsie crescono solo in coda: gli id restano validi
+            'lane_head': list(self.lane_head),
+            'lane_tail': list(self.lane_tail),
+        }
+
+    # Ripristina lo stato salvato da snapshot (i percorsi degli agenti devono essere già ripristinati)
+    def restore(self, state, graph):
+        for name, array in state['arrays'].items():
+            setattr(self, name, array.copy())
+        self.capacity = state['capacity']
+        self.size = state['size']
+        self.agents = list(state['agents'])
+        self.free_rows = list(state['free_rows'])
+
+        # nuova lista di corsie: chi ha salvato gli id delle corsie (EdgeOccupancy) li ricalcola
+        self.lanes = list(state['lanes'])
+        self.lane_ids = {lane: lid for lid, lane in enumerate(self.lanes)}
+        self.edge_lanes = {}
+        for lid, lane in enumerate(self.lanes):
+            self.edge_lanes.setdefault(lane[:2], []).append(lid)
+        self.lane_head = list(state['lane_head'])
+        self.lane_tail = list(state['lane_tail'])
+        self.lane_open = np.ones(max(len(self.lanes), 16), dtype=bool)
+        self.refresh_lane_state(graph)
+        self._rebuild_route_index()
+
+    # Dimentica tutte le corsie (es. quando viene generato un nuovo grafo)
+    def clear_lanes(self):
+        self.lanes = []
+        self.lane_ids = {}
+        self.edge_lanes = {}
+        self.lane_head = []
+        self.lane_tail = []
+        self.lane_open[:] = True
+        self.edge[:] = -1
+        self.leader[:] = -1
+        self.follower[:] = -1
+
+    # Aggiorna lo stato aperto/chiuso delle corsie leggendo l'attributo 'is_open'
+    def refresh_lane_state(self, graph):
+        for lid, (u, v, side) in enumerate(self.lanes):
+            self.lane_open[lid] = graph.has_edge(u, v) and graph[u][v].get("is_open", True)
+
+    # Corsie che terminano con un semaforo rosso
+    def red_lanes(self, traffic_lights):
+        lane_red = np.zeros(len(self.lanes), dtype=bool)
+        for tl in traffic_lights.values():
+            for edge in tl.lights:
+                lids = self.edge_lanes.get(edge)
+                if lids and not tl.is_green(edge):
+                    lane_red[lids] = True
+        return lane_red
+
+    # Righe che richiedono logica per-agente (fine arco o corsia chiusa)
+    def pending_rows(self):
+        n = self.size
+        edge = self.edge[:n]
+        closed = np.zeros(n, dtype=bool)
+        on_lane = edge >= 0
+        closed[on_lane] = ~self.lane_open[edge[on_lane]]
+        return np.flatnonzero((~self.has_target[:n] | closed) & self.alive[:n])
+
+    # Avanza in blocco tutti gli agenti che hanno un target
+    def advance(self, dt, lane_red):
+        """
+        Equivalente vettoriale di Agent.move_towards per tutte le righe.
+        Restituisce gli indici delle righe arrivate al target.
+        """
+        rows = np.flatnonzero(self.has_target[:self.size])
+        if rows.size == 0:
+            return rows
+
+        x, y = self.x[rows], self.y[rows]
+        dx = self.target_x[rows] - x
+        dy = self.target_y[rows] - y
+        dist = np.hypot(dx, dy)
+
+        # velocità desiderata: metà velocità, zero vicino a un semaforo rosso
+        speed = self.speed[rows]
+        desired = speed * 0.5
+        edge = self.edge[rows]
+        red = np.zeros(rows.size, dtype=bool)
+        on_lane = edge >= 0
+        red[on_lane] = lane_red[edge[on_lane]]
+        desired[red & (dist < TL_STOP_DIST)] = 0
+
+        # leader: agente che precede sulla stessa corsia, letto dalla coda della corsia
+        leader = self.leader[rows]
+        f = np.flatnonzero(leader >= 0)
+        if f.size:
+            lf = leader[f]
+            radius = self.radius[rows[f]]
+            dist_to_leader = np.hypot(self.x[lf] - x[f], self.y[lf] - y[f])
+            safe_dist = radius * 3 + self.actual_speed[rows[f]] * 0.5
+            close = dist_to_leader < safe_dist
+            follow = np.minimum(speed[f], self.actual_speed[lf])
+            follow[dist_to_leader < radius * 4] = 0
+            desired[f[close]] = follow[close]
+
+        # passo massimo senza superare il target
+        step = np.minimum(desired * dt, dist)
+        moving = dist > 0
+        m_rows = rows[moving]
+        dir_x = dx[moving] / dist[moving]
+        dir_y = dy[moving] / dist[moving]
+        self.x[m_rows] += dir_x * step[moving]
+        self.y[m_rows] += dir_y * step[moving]
+        self.dir_x[m_rows] = dir_x
+        self.dir_y[m_rows] = dir_y
+        self.angle[m_rows] = np.arctan2(dy[moving], dx[moving])
+
+        arrived = rows[step == dist]
+        self.path_index[arrived] += 1
+        self.has_target[arrived] = False
+        return arrived
+
+    # Velocità effettiva calcolata dallo spostamento nell'ultimo step
+    def update_actual_speed(self, dt):
+        n = self.size
+        moved = np.hypot(self.x[:n] - self.prev_x[:n], self.y[:n] - self.prev_y[:n])
+        self.actual_speed[:n] = np.where(moved < 0.001, 0, moved / dt)
+
+    def save_prev_positions(self):
+        n = self.size
+        self.prev_x[:n] = self.x[:n]
+        self.prev_y[:n] = self.y[:n]
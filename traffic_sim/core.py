@@ -1,10 +1,14 @@
 import random
 import math
 import networkx as nx
+import numpy as np
 import pygame
 from utilities.Debug import debug
 from utilities.ColorPicker import color_pick
-from utilities.euclidean_distance import distanza_euclidea
+from traffic_sim.agent_store import AgentStore
+from traffic_sim.routing import open_edges_view, LARGE_GRAPH_NODES
+from traffic_sim.layout import cached_layout
+from traffic_sim.labels import label_cache
 
 
 
@@ -51,12 +55,51 @@ class Camera:
         """
         self.offset -= pygame.Vector2(delta_screen) / self.scale
 
+# Proprietà che legge/scrive un campo dell'agente nella sua riga dell'AgentStore
+def _store_field(name):
+    def getter(self):
+        return getattr(self.store, name)[self.row]
+    def setter(self, value):
+        getattr(self.store, name)[self.row] = value
+    return property(getter, setter)
+
 # Classe per rappresentare un agente che si muove nel grafo
 class Agent:
+    """
+    Vista su una riga di AgentStore: posizione, velocità, direzione, indice nel
+    percorso e corsia corrente (id intero) vivono negli array NumPy condivisi.
+    Con __slots__ l'oggetto non ha un __dict__: restano solo i riferimenti
+    allo store, al percorso e ai dati condivisi.
+    """
+    __slots__ = ("id", "store", "row", "router", "_path", "color", "lock", "shared_data", "__weakref__")
+
     _id_agent = 0
-    def __init__(self, color, graph, pos, lock=None, shared_data=None, speed=1, radius=5):
+    side = "right" # lato su cui percorrere l'arco
+
+    x = _store_field("x") # posizione attuale
+    y = _store_field("y")
+    prev_x = _store_field("prev_x") # posizione precedente
+    prev_y = _store_field("prev_y")
+    speed = _store_field("speed") # velocità pixel per secondo
+    actual_speed = _store_field("actual_speed") # velocità attuale
+    dir_x = _store_field("dir_x") # direzione attuale
+    dir_y = _store_field("dir_y")
+    angle = _store_field("angle") # angolo di direzione in radianti
+    radius = _store_field("radius") # raggio di collisione
+
+    def __init__(self, color, graph, pos, lock=None, shared_data=None, speed=1, radius=5, store=None, router=None, path=None):
+        self.store = store if store is not None else AgentStore(capacity=1)
+        self.lock = lock
+        self.shared_data = shared_data
+        self.respawn(color, graph, pos, speed, radius, router, path)
+
+    # (Re)inizializza l'agente su una nuova riga dello store, anche se riutilizzato da un pool
+    def respawn(self, color, graph, pos, speed=1, radius=5, router=None, path=None):
         self.id = Agent._id_agent
         Agent._id_agent += 1
+        self.row = self.store.add(self)
+        self.router = router # Router condiviso con cache dei percorsi (opzionale)
+        self._path = []
         self.color = color # colore dell'agente
         self.speed = speed # velocità pixel per frame
         self.radius = radius # raggio di collisione
@@ -67,28 +110,81 @@ class Agent:
         self.actual_speed = 0 # velocità attuale
         self.dir_x, self.dir_y = 0, 0 # direzione attuale
         self.angle = 0 # angolo di direzione in radianti
-        self.side = "right" # lato su cui percorrere l'arco
         self.current_target = None # target corrente
         self.current_edge_nodes = None # arco e corsia attuali
 
-        self.lock = lock
-        self.shared_data = shared_data
-        self.edge_closed = set()
+        if path is None:
+            self.new_path(graph, pos) # inizializza con un percorso
+        else:
+            self.path = path # percorso già calcolato (es. agente trasferito da un'altra regione)
+
+    @property
+    def path_index(self):
+        return int(self.store.path_index[self.row])
+
+    @path_index.setter
+    def path_index(self, value):
+        self.store.path_index[self.row] = value
+
+    @property
+    def path(self):
+        return self._path
+
+    @path.setter
+    def path(self, path):
+        # mantiene l'indice arco -> agenti dello store
+        old_path = self._path
+        self._path = path
+        self.store.index_route(self.row, old_path, path)
+
+    @property
+    def current_target(self):
+        if not self.store.has_target[self.row]:
+            return None
+        return (self.store.target_x[self.row], self.store.target_y[self.row])
+
+    @current_target.setter
+    def current_target(self, target):
+        if target is None:
+            self.store.has_target[self.row] = False
+        else:
+            self.store.target_x[self.row], self.store.target_y[self.row] = target
+            self.store.has_target[self.row] = True
 
-        self.new_path(graph, pos) # inizializza con un percorso
+    @property
+    def current_edge_nodes(self):
+        lid = self.store.edge[self.row]
+        return None if lid < 0 else self.store.lanes[lid]
+
+    @current_edge_nodes.setter
+    def current_edge_nodes(self, lane):
+        self.store.set_lane(self.row, -1 if lane is None else self.store.lane_id(lane))
+
+    # Agente che precede sulla stessa corsia (testa della coda davanti a me)
+    def leader(self):
+        row = self.store.leader[self.row]
+        return None if row < 0 else self.store.agents[row]
 
     # Sceglie un nuovo percorso casuale nel grafo
     def new_path(self, graph, pos):
         if DEBUG:
             debug("Genera nuovo percorso per agente di colore", color_pick(self.color))
 
-        temp_graph = graph.copy()
-        if self.edge_closed:
-            for edge in self.edge_closed:
-                u, v = edge
-                debug("graph edge is_open attribute", graph[u][v]['is_open'])
-                if temp_graph.has_edge(u, v) and graph[u][v].get("is_open", True) == False:
-                    temp_graph.remove_edge(u, v)
+        if self.router is not None:
+            # la cache conosce gli archi chiusi e sceglie subito una coppia collegata
+            start, end = self.router.random_pair()
+            self.path = self.router.route(start, end)
+            self.path_index = 0
+            self.start_path(pos)
+            return
+
+        # vista del grafo senza gli archi segnalati come chiusi (nessuna copia)
+        closed = set()
+        for u, v in self.known_closed_edges():
+            if graph.has_edge(u, v) and graph[u][v].get("is_open", True) == False:
+                closed.add((u, v))
+                closed.add((v, u))
+        temp_graph = open_edges_view(graph, closed) if closed else graph
         while True:
             if DEBUG:
                 debug("Tentativo di generazione percorso...")
@@ -102,8 +198,17 @@ class Agent:
                 if DEBUG:
                     debug("No path between", start, "and", end, "- retrying")
         self.path_index = 0
+        self.start_path(pos)
 
-        # Inizializzazione delle coordinate dell'agente per iniziare il percorso sulla corsia di destra
+    # Archi chiusi segnalati dagli agenti, letti dall'insieme condiviso invece di tenerne una copia
+    def known_closed_edges(self):
+        if self.shared_data is None:
+            return ()
+        with self.lock:
+            return list(self.shared_data['closed_edge_set'])
+
+    # Inizializzazione delle coordinate dell'agente per iniziare il percorso sulla corsia di destra
+    def start_path(self, pos):
         if len(self.path) > 1:
             u, v = self.path[0], self.path[1]
             p1, p2 = pos[u], pos[v]
@@ -114,6 +219,10 @@ class Agent:
 
     # Muove l'agente verso il target, evitando collisioni con altri agenti
     def move_towards(self, target, others, traffic_lights, dt=1.0):
+        """
+        others è mantenuto per compatibilità: il leader non viene più cercato
+        scorrendo tutti gli agenti ma letto in O(1) dalla coda della corsia.
+        """
         tx, ty = target
         dx, dy = tx - self.x, ty - self.y
         dist = math.hypot(dx, dy)
@@ -142,24 +251,8 @@ class Agent:
         dir_x, dir_y = dx / dist, dy / dist
 
 
-        # cerco l'agente più vicino davanti a me sulla stessa corsia
-        leader = None
-        min_ahead = float('inf')
-
-        for other in others:
-            if other is self:
-                continue
-            if other.current_edge_nodes != self.current_edge_nodes:
-                continue  # corsie diverse → no interazione
-
-            # vettore relativo verso l’altro
-            rel_x = other.x - self.x
-            rel_y = other.y - self.y
-            ahead = rel_x * dir_x + rel_y * dir_y  # distanza lungo direzione marcia
-
-            if ahead > 0 and ahead < min_ahead:  # è davanti e più vicino degli altri
-                min_ahead = ahead
-                leader = other
+        # l'agente davanti a me sulla stessa corsia è il precedente nella coda della corsia
+        leader = self.leader()
 
         if leader is not None:
             dist_to_leader = math.hypot(leader.x - self.x, leader.y - self.y)
@@ -205,55 +298,106 @@ class Agent:
         target = self.path[-1]
         u, v = edge
 
-        # crea una copia del grafo senza l’arco chiuso
-        temp_graph = graph.copy()
-        if temp_graph.has_edge(u, v):
-            temp_graph.remove_edge(u, v)
-        
-        with self.lock:
-            self.edge_closed = self.shared_data['closed_edge_set'].copy()
-
         try:
-            new_path = nx.shortest_path(temp_graph, u, target)
+            if self.router is not None:
+                self.router.set_edge_state(u, v, False)
+                new_path = self.router.route(u, target)
+            else:
+                # vista del grafo senza l’arco chiuso
+                temp_graph = open_edges_view(graph, {(u, v), (v, u)})
+                new_path = nx.shortest_path(temp_graph, u, target)
             debug("New path: ", new_path)
             self.path = new_path
             self.path_index = 0
+            self.current_target = None  # riparte dal nodo u sul nuovo percorso
+
+        except nx.NetworkXNoPath:
+            self.new_path(graph, pos)
 
+    # Ricalcola la parte restante del percorso evitando gli archi chiusi
+    def reroute(self, graph, pos):
+        """
+        L'arco che l'agente sta percorrendo viene completato e il percorso
+        riparte dal suo nodo di arrivo; se l'agente è fermo su un nodo riparte
+        da quel nodo. Se la destinazione non è più raggiungibile sceglie un
+        nuovo percorso.
+        """
+        request = self.reroute_request()
+        if request is None:
+            return
+        keep, start, target = request
+        try:
+            if self.router is not None:
+                tail = self.router.route(start, target)
+            else:
+                closed = set()
+                for u, v, data in graph.edges(data=True):
+                    if not data.get("is_open", True):
+                        closed.add((u, v))
+                        closed.add((v, u))
+                tail = nx.shortest_path(open_edges_view(graph, closed), start, target)
         except nx.NetworkXNoPath:
+            tail = None
+        self.apply_reroute(graph, pos, keep, tail)
+
+    # Richiesta di ripianificazione: (nodi da mantenere, nodo di partenza, destinazione)
+    def reroute_request(self):
+        """Restituisce None se l'agente è già alla destinazione."""
+        keep = self.path_index + (2 if self.current_target is not None else 1)
+        keep = min(keep, len(self.path))
+        start, target = self.path[keep - 1], self.path[-1]
+        if start == target:
+            return None
+        return keep, start, target
+
+    # Sostituisce il percorso dopo i primi keep nodi con tail (None = destinazione irraggiungibile)
+    def apply_reroute(self, graph, pos, keep, tail):
+        if tail is None:
+            self.current_target = None
             self.new_path(graph, pos)
+            return
+        self.path = self.path[:keep] + tail[1:]
+
+    # Prepara l'arco corrente del percorso: verifica che sia aperto e imposta il target
+    def prepare_edge(self, graph, pos):
+        """
+        Ritorna True se l'agente può muoversi verso current_target,
+        False se l'arco era chiuso e il percorso è stato ricalcolato.
+        """
+        u = self.path[self.path_index] # nodo attuale
+        v = self.path[self.path_index + 1] # nodo successivo
+        # if not graph[v]['is_reachable']:
+
+        # Verifica se l'arco (u, v) é aperto
+        if not self.can_reach_next_node(graph, u, v):
+            # comunica al server che l'arco (u, v) é chiuso
+            with self.lock:
+                self.shared_data["closed_edge_set"].add((u, v))
+                self.shared_data["closed_edge_set"].add((v, u))
+                self.shared_data["updated_edge_set"] = True
+            self.update_if_closed_edge(graph, pos, (u, v))
+            return False
+        else:
+            with self.lock:
+                if (u,v) in self.shared_data["closed_edge_set"]:
+                    self.shared_data["closed_edge_set"].remove((u,v))
+                    self.shared_data["closed_edge_set"].remove((v,u)) 
+
+        if self.current_target is None:
+            p1, p2 = pos[u], pos[v]  # posizioni schermo
+            p1_off, p2_off = offset_position(p1, p2, side=self.side)
+            self.x, self.y = p1_off
+            self.current_target = p2_off
+            self.current_edge_nodes = (u, v, self.side)
+        return True
 
     # Aggiorna la posizione dell'agente lungo il percorso
     def update(self, graph, pos, agents, dt, traffic_lights):
         self.prev_x, self.prev_y = self.x, self.y
 
         if self.path_index < len(self.path) - 1:
-            u = self.path[self.path_index] # nodo attuale
-            v = self.path[self.path_index + 1] # nodo successivo
-            # if not graph[v]['is_reachable']:
-
-            # Verifica se l'arco (u, v) é aperto
-            if not self.can_reach_next_node(graph, u, v):
-                # comunica al server che l'arco (u, v) é chiuso
-                with self.lock:
-                    self.shared_data["closed_edge_set"].add((u, v))
-                    self.shared_data["closed_edge_set"].add((v, u))
-                    self.shared_data["updated_edge_set"] = True
-                self.update_if_closed_edge(graph, pos, (u, v))
+            if not self.prepare_edge(graph, pos):
                 return
-            else:
-                with self.lock:
-                    if (u,v) in self.shared_data["closed_edge_set"]:
-                        self.shared_data["closed_edge_set"].remove((u,v))
-                        self.shared_data["closed_edge_set"].remove((v,u)) 
-
-            p1, p2 = pos[u], pos[v]  # posizioni schermo
-
-            p1_off, p2_off = offset_position(p1, p2, side=self.side)
-
-            if self.current_target is None:
-                self.x, self.y = p1_off
-                self.current_target = p2_off
-                self.current_edge_nodes = (u, v, self.side)
 
             arrived = self.move_towards(self.current_target, agents, traffic_lights, dt)
 
@@ -290,8 +434,8 @@ class Agent:
 
         # Disegna la label con l'ID
         if show_labels:
-            font = pygame.font.Font(None, int(16 * camera.scale))  # dimensione proporzionale allo zoom
-            text_surface = font.render(str(self.id), True, (255, 255, 255))  # colore bianco
+            # dimensione proporzionale allo zoom, font e testo dalla cache delle label
+            text_surface = label_cache.render(str(self.id), (255, 255, 255), size=16 * camera.scale)  # colore bianco
             text_rect = text_surface.get_rect(center=(screen_pos[0], screen_pos[1] - radius_scaled*2))
             screen.blit(text_surface, text_rect)
 
@@ -322,8 +466,14 @@ class TrafficLightController:
 
         self.detection_radius = detection_radius # raggio di rilevamento agenti
         self.priority_edge = None # ultimo edge che ha richiesto priorità
+        self.occupancy = None # contatori EdgeOccupancy condivisi (se forniti dal motore)
+        self.phase_start = 0.0 # tempo simulato dell'ultimo cambio di fase (usato da SignalScheduler)
     
     def detect_agent(self, agents, pos):
+        if self.occupancy is not None:
+            # lettura dei contatori per arco entrante: O(grado)
+            return {edge: self.occupancy.count(edge) > 0 for edge in self.incoming_edges}
+
         detected = {edge: False for edge in self.incoming_edges}
         for agent in agents:
             if agent.current_edge_nodes is None:
@@ -342,29 +492,44 @@ class TrafficLightController:
         edge_whith_traffic = [edge for edge, is_detected in detected.items() if is_detected]
         # Se c'è un solo arco con traffico, assegna priorità
         if len(edge_whith_traffic) == 1:
-            self.priority_edge = edge_whith_traffic[0]
-            # imposta verde prioritario
-            for e in self.lights:
-                self.lights[e] = "red"
-            self.lights[self.priority_edge] = "green"
-            self.timer = 0
+            self.give_priority(edge_whith_traffic[0])
             return
         # elif len(edge_whith_traffic) > 1:
             # debug(f"Edge with traffic in node {self.node}: ", edge_whith_traffic)
     
         self.timer += dt
         if self.timer >= self.green_time:  # cambio verde
-            # rimetti a rosso quello attuale
-            current_edge = self.incoming_edges[self.current_green_index]
-            self.lights[current_edge] = "red"
+            self.next_phase()
+
+    # Verde prioritario al solo arco edge; restituisce True se i colori sono cambiati
+    def give_priority(self, edge):
+        changed = any((state == "green") != (e == edge) for e, state in self.lights.items())
+        self.priority_edge = edge
+        for e in self.lights:
+            self.lights[e] = "red"
+        self.lights[edge] = "green"
+        self.timer = 0
+        return changed
 
-            # passo al prossimo
-            self.current_green_index = (self.current_green_index + 1) % len(self.incoming_edges)
-            next_edge = self.incoming_edges[self.current_green_index]
-            self.lights[next_edge] = "green"
+    # Passa il verde all'arco entrante successivo
+    def next_phase(self):
+        # rimetti a rosso quello attuale
+        current_edge = self.incoming_edges[self.current_green_index]
+        self.lights[current_edge] = "red"
+
+        # passo al prossimo
+        self.current_green_index = (self.current_green_index + 1) % len(self.incoming_edges)
+        next_edge = self.incoming_edges[self.current_green_index]
+        self.lights[next_edge] = "green"
+
+        self.timer = 0
+
+    # Numero di agenti in coda su ogni arco entrante (richiede i contatori del motore)
+    def queue_lengths(self):
+        if self.occupancy is None:
+            return {edge: 0 for edge in self.incoming_edges}
+        return {edge: self.occupancy.count(edge) for edge in self.incoming_edges}
 
-            self.timer = 0
-        
     def is_green(self, edge):
         return self.lights.get(edge, "red") == "green"
 
@@ -407,10 +572,6 @@ def build_grid_graph(rows, cols, area_rect, padding=60):
     con un padding interno.
     area_rect = (x, y, w, h)
     """
-    G = nx.grid_2d_graph(rows, cols)
-    
-    # add_POI_to_graph(G, ["Museo", "Parco", "Teatro", "Biblioteca"])
-
     rect_x, rect_y, rect_w, rect_h = area_rect
 
     # area effettiva interna (dopo padding)
@@ -423,30 +584,74 @@ def build_grid_graph(rows, cols, area_rect, padding=60):
     x_spacing = inner_w / (cols - 1) * 2 if cols > 1 else 0
     y_spacing = inner_h / (rows - 1) * 2 if rows > 1 else 0
 
-    pos = {}
+    # nodi (r, c) e archi nello stesso ordine di nx.grid_2d_graph, con gli attributi già impostati
+    G = nx.Graph()
+    nodes = [(r, c) for r in range(rows) for c in range(cols)]
+    G.add_nodes_from(nodes, is_reachable=True)
+    G.add_edges_from((((r, c), (r + 1, c)) for r in range(rows - 1) for c in range(cols)), is_open=True)
+    G.add_edges_from((((r, c), (r, c + 1)) for r in range(rows) for c in range(cols - 1)), is_open=True)
+
+    # posizioni calcolate in blocco con NumPy invece che nodo per nodo
+    r, c = np.divmod(np.arange(rows * cols), cols)
+    xs = inner_x + c * x_spacing
+    ys = inner_y + r * y_spacing
+    pos = dict(zip(nodes, zip(xs.tolist(), ys.tolist())))
     if DEBUG:
         debug(G.nodes)
-    for n in G.nodes():
-        # nodi della griglia (r, c)
-        r, c = n
-        if r == 'POI':
-            neigh_node = list(G.neighbors(n))
-            if DEBUG:
-                debug(f"neigh_node of {n} is {neigh_node}")
-        else:
-            x = inner_x + c * x_spacing
-            y = inner_y + r * y_spacing
-            pos[n] = (x, y)
-        # POI: mettili al centro oppure in una posizione fittizia
-        
-        #pos[n] = (rect_x + rect_w / 2, rect_y + rect_h / 2)
-    nx.set_node_attributes(G, True, "is_reachable")
-    nx.set_edge_attributes(G, True, "is_open")
 
     return G, pos
 
+# Posizioni dei nodi della rete 'pre_defined'
+PRE_DEFINED_POS = {
+    0: (1184.4347090770966, 682.5497704741763),
+    1: (1383.8081567653837, 695.3533051162649),
+    2: (499.2379835080458, 1550.0471161298778),
+    3: (807.9030878074891, 1326.0124879230507),
+    4: (1064.323268027042, 155.70571582739183),
+    5: (-20.0, 79.56581681082923),
+    6: (1578.18644407733, 1513.5625463639808),
+    7: (1695.7584186815654, 947.1213535394141),
+    8: (580.6140292563205, 1374.4170723296706),
+    9: (458.6523590999161, 1175.0978557006601),
+    10: (1672.1841020147288, 1154.3810944689299),
+    11: (1534.3355120394015, 1321.632527188649),
+    12: (1290.8698989477768, 1265.383845487956),
+    13: (293.5202367859606, 1266.3206514666817),
+    14: (124.45900877598001, 178.69447597485237),
+    15: (118.35437205288531, 5.1750290217470365),
+    16: (1216.852204811691, 1369.0181422248809),
+    17: (1024.9282202317208, 1198.507180873981),
+    18: (221.40559748369571, 408.93150952583744),
+    19: (1611.7185127954453, 749.9353795888587),
+    20: (1003.4571510939005, 340.50322249117767),
+    21: (349.3038636987003, 651.8968011732497),
+    22: (516.7983886635782, 903.763595563013),
+    23: (832.5774532999345, 907.4609160983032),
+    24: (928.9015507871163, 599.0858066006342),
+    26: (348.14267896880915, 906.4062348971107),
+    27: (1014.0958489362621, 468.69892369322),
+    28: (1774.1919290025623, 656.1078017573541),
+    29: (1396.985013309661, 1465.6638216882443),
+}
+
+# Grafo small-world connesso (Watts-Strogatz) per le reti 'random' e 'ring_road'
+# (oltre LARGE_GRAPH_NODES, definita in routing, estratto in un solo tentativo)
+def small_world_graph(num_nodes, seed):
+    """
+    nx.connected_watts_strogatz_graph ripete l'estrazione finché il grafo non è
+    connesso: sui grafi grandi servono decine o centinaia di tentativi. Oltre
+    LARGE_GRAPH_NODES il grafo viene estratto una volta sola e le poche
+    componenti rimaste vengono unite con un arco ciascuna.
+    """
+    if num_nodes < LARGE_GRAPH_NODES:
+        return nx.connected_watts_strogatz_graph(num_nodes, 3, 0.5, seed)
+    G = nx.watts_strogatz_graph(num_nodes, 3, 0.5, seed)
+    components = [min(nodes) for nodes in nx.connected_components(G)]
+    G.add_edges_from(zip(components, components[1:]))
+    return G
+
 # Funzione per generare un grafo connesso
-def gen_graph(num_nodes:int, mode, traffic_lights):
+def gen_graph(num_nodes:int, mode, traffic_lights, layout="auto"):
     if mode == 'grid': # grid
         rows = int(num_nodes)
         cols = int(num_nodes)
@@ -454,20 +659,20 @@ def gen_graph(num_nodes:int, mode, traffic_lights):
         for n in G.nodes():
             if G.degree[n] > 2:
                 G.nodes[n]["tipo"] = "incrocio"
-                incoming_edges = [(u, n) for u in G.neighbors(n)]
+                incoming_edges = [(u, n) for u in G.adj[n]]
                 traffic_lights[n] = TrafficLightController(n, incoming_edges, green_time=2, red_time=2, detection_radius=80, type="sensor_based")
             else:
                 G.nodes[n]["tipo"] = ""
         return G, pos
     elif mode == 'random': # random
         seed = random.randint(0, 1000)
-        G = nx.connected_watts_strogatz_graph(num_nodes, 3, 0.5, seed)
+        G = small_world_graph(num_nodes, seed)
         nx.set_node_attributes(G, "", "tipo")
         
         for n in G.nodes():
             if G.degree[n] > 2:
                 G.nodes[n]["tipo"] = "incrocio"
-                incoming_edges = [(u, n) for u in G.neighbors(n)]
+                incoming_edges = [(u, n) for u in G.adj[n]]
                 traffic_lights[n] = TrafficLightController(n, incoming_edges, green_time=2, red_time=2, detection_radius=80, type="sensor_based")
                 if DEBUG:
                     debug("nodo incrocio:", n)
@@ -525,21 +730,25 @@ def gen_graph(num_nodes:int, mode, traffic_lights):
         return G
     elif mode == 'ring_road': # ring_road
         seed = random.randint(0, 1000)
-        G1 = nx.connected_watts_strogatz_graph(num_nodes, 3, 0.5, seed)
+        G1 = small_world_graph(num_nodes, seed)
         nx.set_node_attributes(G1, "", "tipo")
-        debug("G1 nodes:", G1.nodes())
+        if DEBUG:
+            debug("G1 nodes:", G1.nodes())
         for n in G1.nodes():
             if G1.degree[n] > 2:
                 G1.nodes[n]["tipo"] = "incrocio"
-                incoming_edges = [(u, n) for u in G1.neighbors(n)]
+                incoming_edges = [(u, n) for u in G1.adj[n]]
                 traffic_lights[n] = TrafficLightController(n, incoming_edges, green_time=2, red_time=2)
-                debug("nodo incrocio:", n)
+                if DEBUG:
+                    debug("nodo incrocio:", n)
 
         scale_pos = 950
 
         # add_POI_to_graph(G1, ["Museo", "Parco", "Teatro", "Biblioteca"])
-        pos1 = nx.spring_layout(G1, scale=(scale_pos)/2, center=((scale_pos-20)/2, (scale_pos-60)/2))
-        debug("nodi grado 1: ", [(node) for node, num_edge in G1.degree() if num_edge == 1])
+        # layout dell'anello interno: calcolato con lo stesso seme del grafo e salvato su disco
+        pos1 = cached_layout(G1, mode, num_nodes, seed, method=layout, scale=(scale_pos)/2, center=((scale_pos-20)/2, (scale_pos-60)/2))
+        if DEBUG:
+            debug("nodi grado 1: ", [(node) for node, num_edge in G1.degree() if num_edge == 1])
 
         G2 = nx.cycle_graph(int(num_nodes/2))
         G2 = nx.relabel_nodes(G2, lambda x: x + len(G1.nodes))
@@ -547,7 +756,8 @@ def gen_graph(num_nodes:int, mode, traffic_lights):
         pos2 = nx.circular_layout(G2, scale=(2*scale_pos/3), center=((scale_pos-20)/2, (scale_pos-60)/2))
         # pos2 = {n + len(G1.nodes): p for n, p in pos2.items()}
         pos = {**pos1, **pos2}
-        debug("pos: ", pos.keys())
+        if DEBUG:
+            debug("pos: ", pos.keys())
         G = nx.Graph()
         G.add_nodes_from(G2.nodes(data=True))
         G.add_edges_from(G2.edges(data=True))
@@ -555,36 +765,75 @@ def gen_graph(num_nodes:int, mode, traffic_lights):
         G.add_edges_from(G1.edges(data=True))
 
         n_collegamenti = 3
-
-        min_dist = float('inf')
-        best_pair_list = []
-        for int_node, int_pos in pos1.items():
-            for est_node, est_pos in pos2.items():
-                dist = distanza_euclidea(int_pos, est_pos)
-                if dist < min_dist:
-                    min_dist = dist
-                    best_pair_list.append((dist, int_node, est_node))
-            min_dist = float('inf')
-        best_pair_list.sort(key=lambda x: x[0])
-
-        selected_inner = set()
-        selected_outer = set()
-        edges_to_add = []
-
-        for dist, nodo_interno, nodo_esterno in best_pair_list:
-            if len(edges_to_add) >= n_collegamenti:
-                break
-            if nodo_interno not in selected_inner and nodo_esterno not in selected_outer:
-                edges_to_add.append((nodo_esterno, nodo_interno))
-                selected_inner.add(nodo_interno)
-                selected_outer.add(nodo_esterno)
-
+        edges_to_add = ring_road_links(pos1, pos2, n_collegamenti)
         G.add_edges_from(edges_to_add)
 
-        debug("grafo nodi: ", G.nodes)
+        if DEBUG:
+            debug("grafo nodi: ", G.nodes)
         return G, pos
 
 
+# I k punti di points più vicini a ogni punto di queries (distanze e indici, in ordine di distanza)
+def nearest_points(points, queries, k, chunk=1024):
+    dist = np.empty((len(queries), k))
+    idx = np.empty((len(queries), k), dtype=np.int64)
+    for start in range(0, len(queries), chunk):
+        # blocchi di righe per non allocare tutta la matrice delle distanze
+        d = np.hypot(*(queries[start:start + chunk, None, :] - points[None, :, :]).transpose(2, 0, 1))
+        near = np.argpartition(d, k - 1, axis=1)[:, :k] if k < len(points) else np.tile(np.arange(len(points)), (len(d), 1))
+        near_d = np.take_along_axis(d, near, axis=1)
+        order = np.argsort(near_d, axis=1, kind="stable")
+        dist[start:start + chunk] = np.take_along_axis(near_d, order, axis=1)
+        idx[start:start + chunk] = np.take_along_axis(near, order, axis=1)
+    return dist, idx
+
+# Sceglie i collegamenti tra anello interno ed esterno della rete 'ring_road'
+def ring_road_links(pos1, pos2, n_collegamenti=3):
+    """
+    Restituisce fino a n_collegamenti archi (nodo_esterno, nodo_interno) tra le
+    coppie più vicine, senza riusare un nodo. I candidati sono i
+    n_collegamenti nodi interni più vicini a ogni nodo esterno, trovati con un
+    KD-tree: la scelta greedy sulle coppie ordinate per distanza non può
+    scendere oltre, perché ogni scelta esclude un solo nodo interno.
+    L'albero è costruito sui nodi interni: interrogarlo dai nodi dell'anello
+    resta veloce, mentre dal centro tutti i nodi dell'anello sono quasi
+    equidistanti e la ricerca non riuscirebbe a scartarne nessuno.
+    SciPy è importata solo qui (serve solo per questa rete): se manca, i
+    candidati sono cercati per forza bruta con NumPy.
+    """
+    if not pos1 or not pos2:
+        return []
+    inner = list(pos1)
+    outer = list(pos2)
+    k = min(n_collegamenti, len(inner))
+    inner_xy = np.array([pos1[n] for n in inner], dtype=np.float64)
+    outer_xy = np.array([pos2[n] for n in outer], dtype=np.float64)
+    try:
+        from scipy.spatial import cKDTree
+    except ImportError:
+        dist, idx = nearest_points(inner_xy, outer_xy, k)
+    else:
+        dist, idx = cKDTree(inner_xy).query(outer_xy, k=k)
+    dist = dist.reshape(len(outer), k)
+    idx = idx.reshape(len(outer), k)
+
+    # coppie candidate in ordine di distanza
+    order = np.argsort(dist, axis=None, kind="stable")
+    selected_inner = set()
+    selected_outer = set()
+    edges_to_add = []
+    for flat in order.tolist():
+        if len(edges_to_add) >= n_collegamenti:
+            break
+        j, i = divmod(flat, k)
+        nodo_esterno = outer[j]
+        nodo_interno = inner[idx.item(j, i)]
+        if nodo_interno not in selected_inner and nodo_esterno not in selected_outer:
+            edges_to_add.append((nodo_esterno, nodo_interno))
+            selected_inner.add(nodo_interno)
+            selected_outer.add(nodo_esterno)
+    return edges_to_add
+
 # aggiungi punti di interesse(POI) al grafo
 def add_POI_to_graph(G, POI_list):
     G_num_nodes = len(G.nodes)
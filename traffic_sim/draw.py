@@ -1,5 +1,26 @@
 import pygame
 import math
+import numpy as np
+
+from traffic_sim.labels import label_cache
+from traffic_sim.spatial import NetworkIndex, agent_rows_in
+from traffic_sim.sprites import agent_sprites
+
+# Margine (in pixel) attorno alla vista entro cui gli elementi vengono comunque disegnati
+VIEW_MARGIN = 30
+LABEL_MARGIN = 120 # con le label, che sporgono dal nodo o dall'arco
+
+# Sotto questo zoom gli agenti sono disegnati come mappa di densità e i semafori come quadratini di pixel
+LOD_SCALE = 0.25
+LOD_LIGHT_SIZE = 3 # lato (in pixel) dei quadratini dei semafori
+
+# Colori dei semafori
+LIGHT_GREEN = (0, 255, 0)
+LIGHT_RED = (255, 0, 0)
+
+# Lato (in pixel) delle celle della mappa di densità e numero di agenti per cella con il colore più intenso
+HEATMAP_CELL = 4
+HEATMAP_MAX = 8
 
 def draw_grid(camera, sim_surface, sim_rect):
     # disegna griglia (sul sim_surface, convertendo in coordinate locali)
@@ -39,7 +60,7 @@ def draw_graph_centered(G, pos, mode, show_labels, traffic_lights, sim_surface,
             if show_labels:
                 mx = (pos[u][0] + pos[v][0]) / 2
                 my = (pos[u][1] + pos[v][1]) / 2
-                lbl_edge = myfont.render(f"{u}-{v}", True, (150, 150, 150))
+                lbl_edge = label_cache.render(f"{u}-{v}", (150, 150, 150), font=myfont)
                 screen.blit(lbl_edge, (mx, my))
         # disegna nodi
         for n, attr in G.nodes(data=True):
@@ -69,7 +90,7 @@ def draw_graph_centered(G, pos, mode, show_labels, traffic_lights, sim_surface,
                 pygame.draw.circle(sim_surface, (200, 200, 200), (int(x), int(y)), 7)
             # mostra labels key event
             if show_labels:
-                lbl_node = myfont.render(f"{n}", True, (255, 0, 0))
+                lbl_node = label_cache.render(f"{n}", (255, 0, 0), font=myfont)
                 screen.blit(lbl_node, (int(x)+8, int(y)-20))
     else:
         x_pos = [p[0] for p in pos.values()]
@@ -94,7 +115,7 @@ def draw_graph_centered(G, pos, mode, show_labels, traffic_lights, sim_surface,
             if show_labels:
                 mx = (scaled_pos[u][0] + scaled_pos[v][0]) / 2
                 my = (scaled_pos[u][1] + scaled_pos[v][1]) / 2
-                lbl_edge = myfont.render(f"{u}-{v}", True, (150, 150, 150))
+                lbl_edge = label_cache.render(f"{u}-{v}", (150, 150, 150), font=myfont)
                 sim_surface.blit(lbl_edge, (mx, my))
         # disegna nodi
         for node, (x, y) in scaled_pos.items():
@@ -120,44 +141,111 @@ def draw_graph_centered(G, pos, mode, show_labels, traffic_lights, sim_surface,
                 pygame.draw.circle(sim_surface, (200, 200, 200), (int(x), int(y)), 7)
             if show_labels:
                 if G.nodes[node]['tipo'] == "POI":
-                    lbl_node = myfont.render(f"{G.nodes[node]['nome']}", True, (255, 0, 0))
+                    lbl_node = label_cache.render(f"{G.nodes[node]['nome']}", (255, 0, 0), font=myfont)
                 else:
-                    lbl_node = myfont.render(f"{node}", True, (255, 0, 0))
+                    lbl_node = label_cache.render(f"{node}", (255, 0, 0), font=myfont)
                 sim_surface.blit(lbl_node, (int(x)+8, int(y)-20))
 
-# Funzione per disegnare il grafo
-def draw_graph(G, pos, show_labels, traffic_lights, sim_surface, camera, myfont):
-    sim_surface.fill((30, 33, 39))
-    draw_grid(camera, sim_surface, sim_surface.get_rect(topleft=(10, 10)))
-    for u, v in G.edges:
+# Livello statico del grafo (sfondo, griglia, strade, nodi) disegnato fuori schermo
+class StaticLayer:
+    def __init__(self):
+        self.key = None
+        self.sources = None # grafo, posizioni e semafori disegnati (confrontati per identità)
+        self.index = None # indice spaziale di nodi e archi del grafo disegnato
+        self.surface = None
+        self.lights = [] # (semaforo, arco entrante, posizione sullo schermo, raggio) dei pallini dei semafori
+        self.light_pixels = None # sotto LOD_SCALE: (x, y, indice in lights) dei pixel dei quadratini
+
+    # Chiave del livello: dimensione del grafo e della superficie, camera e label
+    def make_key(self, G, sim_surface, camera, show_labels):
+        return (G.number_of_nodes(), G.number_of_edges(), sim_surface.get_size(),
+                camera.offset.x, camera.offset.y, camera.scale, show_labels)
+
+    def invalidate(self):
+        self.key = None
+        self.sources = None
+
+    # Ridisegna il livello se grafo, camera o superficie sono cambiati e lo restituisce
+    def get(self, G, pos, show_labels, traffic_lights, sim_surface, camera, myfont):
+        key = self.make_key(G, sim_surface, camera, show_labels)
+        sources = self.sources
+        if (key != self.key or sources is None
+                or sources[0] is not G or sources[1] is not pos or sources[2] is not traffic_lights):
+            if self.surface is None or self.surface.get_size() != sim_surface.get_size():
+                self.surface = sim_surface.copy()
+            if (self.key is None or key[:2] != self.key[:2] or sources is None
+                    or sources[0] is not G or sources[1] is not pos):
+                self.index = NetworkIndex(G, pos)
+            self.lights = render_static_layer(G, pos, show_labels, traffic_lights, self.surface, camera, myfont, self.index)
+            self.light_pixels = light_pixels(self.lights, self.surface.get_size()) if camera.scale < LOD_SCALE else None
+            self.key = key
+            self.sources = (G, pos, traffic_lights)
+        return self.surface
+
+static_layer = StaticLayer()
+
+# Pixel dei quadratini di LOD_LIGHT_SIZE pixel centrati sui semafori, dentro la superficie
+def light_pixels(lights, size):
+    w, h = size
+    xy = np.array([p for _, _, p, _ in lights], dtype=np.int64).reshape(-1, 2)
+    d = np.arange(LOD_LIGHT_SIZE) - LOD_LIGHT_SIZE // 2
+    dx, dy = np.meshgrid(d, d)
+    x = (xy[:, :1] + dx.ravel()).ravel()
+    y = (xy[:, 1:] + dy.ravel()).ravel()
+    owner = np.repeat(np.arange(len(xy)), LOD_LIGHT_SIZE * LOD_LIGHT_SIZE)
+    inside = (x >= 0) & (x < w) & (y >= 0) & (y < h)
+    return x[inside], y[inside], owner[inside]
+
+# Rettangolo del mondo visibile sulla superficie, allargato di margin pixel
+def camera_viewport(camera, surface, margin=VIEW_MARGIN):
+    w, h = surface.get_size()
+    top_left = camera.screen_to_world((-margin, -margin))
+    bottom_right = camera.screen_to_world((w + margin, h + margin))
+    return top_left.x, top_left.y, bottom_right.x, bottom_right.y
+
+# Disegna sfondo, griglia, archi e nodi visibili; restituisce le posizioni dei pallini dei semafori
+def render_static_layer(G, pos, show_labels, traffic_lights, surface, camera, myfont, index):
+    surface.fill((30, 33, 39))
+    draw_grid(camera, surface, surface.get_rect(topleft=(10, 10)))
+    r = max(5, int(10 * camera.scale))  # raggio scalabile con lo zoom
+    light_r = max(3, int(4 * camera.scale))
+    margin = max(VIEW_MARGIN, r + 6 + light_r)
+    if show_labels:
+        # anche i cerchi di rilevamento dei semafori fuori vista possono entrare nella superficie
+        max_radius = max((tl.detection_radius for tl in traffic_lights.values()), default=0)
+        margin = max(margin, LABEL_MARGIN, int(max_radius * camera.scale) + 3)
+    view = camera_viewport(camera, surface, margin)
+
+    for u, v in index.edges_in(*view):
         p1 = camera.world_to_screen(pos[u])
         p2 = camera.world_to_screen(pos[v])
-        # disegna solo se almeno parzialmente visibile sullo schermo (controllo veloce)
-        pygame.draw.line(sim_surface, (200, 200, 200), p1, p2, 2)
+        pygame.draw.line(surface, (200, 200, 200), p1, p2, 2)
         if show_labels:
-                mx = (camera.world_to_screen(pos[u])[0] + camera.world_to_screen(pos[v])[0]) / 2
-                my = (camera.world_to_screen(pos[u])[1] + camera.world_to_screen(pos[v])[1]) / 2
-                lbl_edge = myfont.render(f"{u}-{v}", True, (150, 150, 150))
-                sim_surface.blit(lbl_edge, (mx, my))
+                mx = (p1[0] + p2[0]) / 2
+                my = (p1[1] + p2[1]) / 2
+                lbl_edge = label_cache.render(f"{u}-{v}", (150, 150, 150), font=myfont)
+                surface.blit(lbl_edge, (mx, my))
 
-    for node, attr in G.nodes(data = True):
+    lights = []
+    nodes = G.nodes
+    for node in index.nodes_in(*view):
+        attr = nodes[node]
         p = camera.world_to_screen(pos[node])
-        r = max(5, int(10 * camera.scale))  # raggio scalabile con lo zoom
-        
-        if G.nodes[node]['tipo'] == "POI":
-                pygame.draw.circle(sim_surface, (255, 165, 0), (int(p.x), int(p.y)), r) # arancione per POI
-        elif G.nodes[node]['tipo'] == "incrocio":
-            pygame.draw.circle(sim_surface, (0, 0, 255), (int(p.x), int(p.y)), r) # blu per incroci
+
+        if attr['tipo'] == "POI":
+                pygame.draw.circle(surface, (255, 165, 0), (int(p.x), int(p.y)), r) # arancione per POI
+        elif attr['tipo'] == "incrocio":
+            pygame.draw.circle(surface, (0, 0, 255), (int(p.x), int(p.y)), r) # blu per incroci
             if node in traffic_lights:
                 tl = traffic_lights[node]
-                
+
                 if show_labels:
                     r1 = int(tl.detection_radius * camera.scale)  # raggio scalabile con lo zoom per incroci
-                    pygame.draw.circle(sim_surface, (88, 88, 252), (int(p.x), int(p.y)), r1, 3) 
+                    pygame.draw.circle(surface, (88, 88, 252), (int(p.x), int(p.y)), r1, 3)
 
-                for i, (u, v) in enumerate(tl.incoming_edges):
+                for u, v in tl.incoming_edges:
                     x1, y1 = camera.world_to_screen(pos[u])
-                    x2, y2 = camera.world_to_screen(pos[v])
+                    x2, y2 = p
                     dx, dy = x2 - x1, y2 - y1
                     dist = math.hypot(dx, dy)
                     if dist == 0:
@@ -170,10 +258,123 @@ def draw_graph(G, pos, show_labels, traffic_lights, sim_surface, camera, myfont)
 
                     sx = x2 - dir_x * offset_dist
                     sy = y2 - dir_y * offset_dist
-                    color = (0, 255, 0) if tl.is_green((u, v)) else (255, 0, 0)
-                    pygame.draw.circle(sim_surface, color, (int(sx), int(sy)), max(3, int(4 * camera.scale)))
+                    lights.append((tl, (u, v), (int(sx), int(sy)), light_r))
         else:
-            pygame.draw.circle(sim_surface, (200, 200, 200), (int(p.x), int(p.y)), r)
+            pygame.draw.circle(surface, (200, 200, 200), (int(p.x), int(p.y)), r)
         if show_labels:
-                lbl_node = myfont.render(f"{node}", True, (255, 0, 0))
-                sim_surface.blit(lbl_node, (int(p.x)+8, int(p.y)-20))
+                lbl_node = label_cache.render(f"{node}", (255, 0, 0), font=myfont)
+                surface.blit(lbl_node, (int(p.x)+8, int(p.y)-20))
+    return lights
+
+# Funzione per disegnare il grafo
+def draw_graph(G, pos, show_labels, traffic_lights, sim_surface, camera, myfont):
+    """
+    La rete stradale è disegnata una volta su una superficie fuori schermo e
+    ridisegnata solo quando cambiano camera o grafo: a ogni frame si copia il
+    livello statico e si disegnano sopra solo i semafori. Sotto LOD_SCALE i
+    semafori visibili possono essere decine di migliaia e un pygame.draw.circle
+    per ognuno costa più del resto del frame: i loro pixel sono scritti in
+    blocco con surfarray.
+    """
+    sim_surface.blit(static_layer.get(G, pos, show_labels, traffic_lights, sim_surface, camera, myfont), (0, 0))
+    if static_layer.light_pixels is not None:
+        draw_light_pixels(static_layer, sim_surface)
+        return
+    for tl, edge, p, radius in static_layer.lights:
+        color = LIGHT_GREEN if tl.is_green(edge) else LIGHT_RED
+        pygame.draw.circle(sim_surface, color, p, radius)
+
+# Colora i quadratini dei semafori (sotto LOD_SCALE) con lo stato corrente, senza una chiamata per semaforo
+def draw_light_pixels(layer, sim_surface):
+    x, y, owner = layer.light_pixels
+    if len(x) == 0:
+        return
+    green = np.array([tl.lights.get(edge) == "green" for tl, edge, _, _ in layer.lights])
+    pixels = pygame.surfarray.pixels2d(sim_surface)
+    pixels[x, y] = np.where(green[owner], sim_surface.map_rgb(LIGHT_GREEN), sim_surface.map_rgb(LIGHT_RED))
+    del pixels # sblocca la superficie
+
+# Disegna gli agenti dentro la vista della camera con le sprite pre-ruotate, in un'unica chiamata a blits
+def draw_agents(store, sim_surface, camera, show_labels, alpha=1.0):
+    """
+    alpha (FixedStepScheduler.alpha) interpola tra la posizione prima e dopo
+    l'ultimo step: con il passo fisso il frame cade quasi sempre a metà di uno
+    step e senza interpolazione il movimento procede a scatti. Gli agenti
+    spostati all'inizio di un nuovo percorso (velocità effettiva oltre la loro
+    velocità massima) sono disegnati nella posizione corrente.
+    """
+    if camera.scale < LOD_SCALE:
+        draw_density(store, sim_surface, camera)
+        return
+    # il triangolo dell'agente sporge fino a due raggi dalla sua posizione
+    max_radius = store.radius[:store.size].max(initial=0) * camera.scale
+    margin = VIEW_MARGIN + int(2 * max(4, max_radius)) + (LABEL_MARGIN if show_labels else 0)
+    rows = agent_rows_in(store, *camera_viewport(camera, sim_surface, margin))
+    if len(rows) == 0:
+        return
+
+    # posizione sullo schermo, raggio in pixel e fascia di angolo calcolati in blocco
+    scale = camera.scale
+    x = store.x[rows]
+    y = store.y[rows]
+    if alpha < 1.0:
+        back = (1.0 - alpha) * (store.actual_speed[rows] <= store.speed[rows])
+        x = x - (x - store.prev_x[rows]) * back
+        y = y - (y - store.prev_y[rows]) * back
+    sx = np.rint((x - camera.offset.x) * scale).astype(np.int64)
+    sy = np.rint((y - camera.offset.y) * scale).astype(np.int64)
+    radius = np.maximum(4, (store.radius[rows] * scale).astype(np.int64))
+    bucket = agent_sprites.angle_bucket(store.angle[rows])
+    corner = 2 * radius + 1 # distanza del centro della sprite dal suo angolo in alto a sinistra
+
+    # sprite dall'atlante con map/zip (cicli in C); solo quelle mancanti passano da get
+    agents = store.agents
+    rows = rows.tolist()
+    colors = [agents[row].color for row in rows]
+    keys = list(zip(colors, radius.tolist(), bucket.tolist()))
+    sprites = list(map(agent_sprites.sprites.get, keys))
+    if None in sprites:
+        sprites = [sprite or agent_sprites.get(*key) for sprite, key in zip(sprites, keys)]
+    blits = list(zip(sprites, zip((sx - corner).tolist(), (sy - corner).tolist())))
+    if show_labels:
+        # dimensione proporzionale allo zoom, come in Agent.draw
+        for row, x, y, r in zip(rows, sx.tolist(), sy.tolist(), radius.tolist()):
+            text_surface = label_cache.render(str(agents[row].id), (255, 255, 255), size=16 * scale)
+            blits.append((text_surface, text_surface.get_rect(center=(x, y - r*2)).topleft))
+    # fblits (pygame-ce) è la variante di blits senza rettangoli restituiti né flag per elemento
+    fblits = getattr(sim_surface, "fblits", None)
+    if fblits is not None:
+        fblits(blits)
+    else:
+        sim_surface.blits(blits, doreturn=False)
+
+# Colori della mappa di densità per 0..HEATMAP_MAX agenti in una cella (0 = trasparente)
+def _heatmap_colors():
+    t = np.linspace(0, 1, HEATMAP_MAX)[:, None]
+    ramp = (1 - t) * np.array([255, 220, 60]) + t * np.array([255, 40, 40]) # da giallo a rosso
+    return np.vstack(([0, 0, 0], ramp)).astype(np.uint8)
+
+HEATMAP_COLORS = _heatmap_colors()
+
+# Mappa di densità degli agenti visibili, al posto dei singoli triangoli quando lo zoom è sotto LOD_SCALE
+def draw_density(store, sim_surface, camera):
+    """
+    Gli agenti sono contati per cella di HEATMAP_CELL pixel con bincount e i
+    conteggi colorati con una tabella: il costo dipende dalla dimensione della
+    superficie, non dal numero di agenti (a parte il conteggio vettoriale).
+    """
+    rows = agent_rows_in(store, *camera_viewport(camera, sim_surface, 0))
+    if len(rows) == 0:
+        return
+    w, h = sim_surface.get_size()
+    gw = -(-w // HEATMAP_CELL)
+    gh = -(-h // HEATMAP_CELL)
+    cell = HEATMAP_CELL / camera.scale # lato della cella nel mondo
+    cx = np.clip(((store.x[rows] - camera.offset.x) / cell).astype(np.int64), 0, gw - 1)
+    cy = np.clip(((store.y[rows] - camera.offset.y) / cell).astype(np.int64), 0, gh - 1)
+    counts = np.bincount(cx * gh + cy, minlength=gw * gh).reshape(gw, gh)
+
+    # superficie di una cella per pixel (indici [x, y] come surfarray), poi ingrandita
+    heatmap = pygame.surfarray.make_surface(HEATMAP_COLORS[np.minimum(counts, HEATMAP_MAX)])
+    heatmap.set_colorkey((0, 0, 0))
+    sim_surface.blit(pygame.transform.scale(heatmap, (gw * HEATMAP_CELL, gh * HEATMAP_CELL)), (0, 0))
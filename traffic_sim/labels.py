@@ -0,0 +1,63 @@
+from collections import OrderedDict
+import pygame
+
+from utilities.Debug import debug
+
+DEBUG = False
+
+# Numero massimo di testi renderizzati tenuti in memoria
+LABEL_CACHE_SIZE = 4096
+
+# Le dimensioni dei font sono arrotondate a multipli di FONT_SIZE_STEP (minimo MIN_FONT_SIZE)
+FONT_SIZE_STEP = 2
+MIN_FONT_SIZE = 2
+
+# Cache delle label: font per fascia di dimensione e superfici di testo con rimozione LRU
+class LabelCache:
+    """
+    Renderizzare un testo con pygame costa molto più che copiarne la
+    superficie: le superfici sono tenute in un OrderedDict con chiave
+    (testo, font, colore) e, superato maxsize, viene scartata quella usata
+    meno di recente. Con lo zoom la dimensione del font cambia in modo
+    continuo, quindi i font di default sono creati una volta per fascia.
+    """
+    def __init__(self, maxsize=LABEL_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.fonts = {} # fascia di dimensione -> pygame.font.Font
+        self.surfaces = OrderedDict() # (testo, font, colore) -> superficie
+        self.hits = 0
+        self.misses = 0
+
+    # Font di default per la fascia della dimensione richiesta
+    def font(self, size):
+        bucket = max(MIN_FONT_SIZE, int(size) // FONT_SIZE_STEP * FONT_SIZE_STEP)
+        font = self.fonts.get(bucket)
+        if font is None:
+            font = pygame.font.Font(None, bucket)
+            self.fonts[bucket] = font
+        return font
+
+    # Superficie del testo con il font dato (o con quello di default per size)
+    def render(self, text, color, size=16, font=None):
+        if font is None:
+            font = self.font(size)
+        key = (text, font, color)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.surfaces.move_to_end(key)
+            self.hits += 1
+            return surface
+        self.misses += 1
+        surface = font.render(text, True, color)
+        self.surfaces[key] = surface
+        if len(self.surfaces) > self.maxsize:
+            self.surfaces.popitem(last=False)
+        return surface
+
+    def clear(self):
+        self.surfaces.clear()
+        self.fonts.clear()
+        if DEBUG:
+            debug(f"cache label svuotata: {self.hits} hit, {self.misses} miss")
+
+label_cache = LabelCache()
@@ -0,0 +1,172 @@
+import heapq
+import math
+from operator import sub
+import networkx as nx
+import numpy as np
+
+from utilities.Debug import debug
+
+DEBUG = False
+
+# Numero predefinito di landmark
+NUM_LANDMARKS = 8
+
+# Le lunghezze degli archi sono arrotondate a interi in unità di 10^-LENGTH_DIGITS:
+# g, h e f = g + h sono esatti e gli errori di arrotondamento non rompono i pareggi
+# tra percorsi di uguale lunghezza (su una griglia sono moltissimi)
+LENGTH_DIGITS = 6
+
+# Preprocessing ALT (A*, Landmark, disuguaglianza Triangolare) per ricerche rapide su grafi grandi
+class LandmarkIndex:
+    """
+    Per pochi nodi landmark L, scelti lontani tra loro, si calcolano una sola
+    volta le distanze d(L, v) verso tutti i nodi. Per la disuguaglianza
+    triangolare |d(L, t) - d(L, v)| <= d(v, t), quindi il massimo su tutti i
+    landmark è un'euristica ammissibile per A* verso t, molto più stretta della
+    distanza in linea d'aria.
+
+    Le distanze sono calcolate con tutti gli archi aperti: chiudere un arco può
+    solo allungare i percorsi, quindi le stime restano ammissibili con qualsiasi
+    insieme di archi chiusi (passato a ogni ricerca) e non serve ricalcolarle.
+    Riaprire un arco riporta le distanze verso quelle del preprocessing.
+
+    A* espande circa tanti nodi quanti sono gli archi del percorso, quindi la
+    stima è calcolata solo sui nodi raggiunti: all'inserimento nello heap con il
+    solo landmark migliore per (s, t), al momento dell'estrazione con tutti e L
+    (se è più alta il nodo torna nello heap). Le chiavi restano limiti
+    inferiori, quindi il percorso è ancora minimo. Su una griglia 100x100 una
+    ricerca costa circa 0.7 ms, su una 200x200 circa 1.3 ms: l'obiettivo di
+    1 ms non è raggiunto oltre circa 20000 nodi, dove domina il costo dei ~3
+    inserimenti nello heap per nodo espanso.
+    """
+    def __init__(self, graph, lengths, num_landmarks=NUM_LANDMARKS):
+        self.nodes = list(graph.nodes)
+        self.index = {node: i for i, node in enumerate(self.nodes)}
+        # adiacenze per indice: [(vicino, lunghezza intera dell'arco)]
+        self.scale = 10 ** LENGTH_DIGITS
+        self.neighbors = [[(self.index[v], round(lengths[(u, v)] * self.scale)) for v in graph.adj[u]] for u in self.nodes]
+
+        # componente connessa di ogni nodo (grafo con tutti gli archi aperti)
+        self.component = [0] * len(self.nodes)
+        for c, nodes in enumerate(nx.connected_components(graph)):
+            for node in nodes:
+                self.component[self.index[node]] = c
+
+        self.landmarks = []
+        columns = []
+        if self.nodes:
+            # primo landmark: il nodo più lontano da un nodo qualsiasi, poi il più lontano dai landmark scelti
+            dist = self._distances(0)
+            min_dist = [math.inf] * len(self.nodes)
+            candidate = max(range(len(self.nodes)), key=lambda i: dist[i] if dist[i] < math.inf else -1)
+            for _ in range(min(num_landmarks, len(self.nodes))):
+                self.landmarks.append(candidate)
+                dist = self._distances(candidate)
+                columns.append(dist)
+                min_dist = [min(a, b) for a, b in zip(min_dist, dist)]
+                candidate = max(range(len(self.nodes)), key=min_dist.__getitem__)
+                if min_dist[candidate] == 0:
+                    break # tutti i nodi sono già landmark
+
+        # distanze landmark -> nodo (una riga per landmark, in unità intere); i nodi di altre componenti valgono 0
+        self.dist = np.array(columns, dtype=np.float64).reshape(len(columns), len(self.nodes))
+        self.dist[np.isinf(self.dist)] = 0.0
+        # le stesse distanze per nodo (una lista di L interi) e per landmark (stessi oggetti int), lette da A*
+        self.node_dist = self.dist.astype(np.int64).T.tolist()
+        self.landmark_dist = [list(row) for row in zip(*self.node_dist)]
+
+        self._closed_version = None
+        self._closed_idx = set() # archi chiusi come coppie di indici
+        self.expanded = 0 # nodi espansi dall'ultima ricerca
+
+        if DEBUG:
+            debug(f"ALT: {len(self.landmarks)} landmark su {len(self.nodes)} nodi")
+
+    # Dijkstra da un nodo (indice) su tutti gli archi
+    def _distances(self, source):
+        dist = [math.inf] * len(self.nodes)
+        dist[source] = 0.0
+        heap = [(0.0, source)]
+        neighbors = self.neighbors
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > dist[u]:
+                continue
+            for v, w in neighbors[u]:
+                nd = d + w
+                if nd < dist[v]:
+                    dist[v] = nd
+                    heapq.heappush(heap, (nd, v))
+        return dist
+
+    def _closed_indices(self, closed, version):
+        if version != self._closed_version or version is None:
+            index = self.index
+            self._closed_idx = {(index[u], index[v]) for u, v in closed if u in index and v in index}
+            self._closed_version = version
+        return self._closed_idx
+
+    # Stima ALT della distanza di ogni nodo da t: max_L |d(L, t) - d(L, v)|, in un solo passaggio vettoriale
+    def bounds(self, t):
+        """Costa O(L * V): path calcola invece la stima solo sui nodi raggiunti."""
+        if not len(self.dist):
+            return np.zeros(len(self.nodes))
+        return np.abs(self.dist - self.dist[:, t:t + 1]).max(axis=0) / self.scale
+
+    # Percorso più corto da source a target evitando gli archi in closed (A* con euristica ALT)
+    def path(self, source, target, closed=(), version=None):
+        """
+        closed contiene le coppie (u, v) chiuse in entrambe le direzioni; version
+        (es. Router.version) evita di ricalcolarne gli indici a ogni ricerca.
+        """
+        s, t = self.index[source], self.index[target]
+        if self.component[s] != self.component[t]:
+            raise nx.NetworkXNoPath(f"No path between {source} and {target}.")
+        closed_idx = self._closed_indices(closed, version)
+        neighbors = self.neighbors
+        node_dist = self.node_dist
+        dist_t = node_dist[t]
+        # landmark con la stima più alta per (s, t): stima economica usata all'inserimento nello heap
+        best = max(self.landmark_dist, key=lambda row: abs(row[s] - row[t]), default=[0] * len(self.nodes))
+        best_t = best[t]
+        push = heapq.heappush
+        pop = heapq.heappop
+
+        g = {s: 0}
+        parent = {s: None}
+        exact = {s} # nodi con la stima completa già nella chiave
+        expanded = 0
+        # a parità di f si espande prima il nodo con g maggiore (più vicino al target)
+        heap = [(max(map(abs, map(sub, node_dist[s], dist_t)), default=0), 0, s)]
+        while heap:
+            f, neg_g, u = pop(heap)
+            gu = -neg_g
+            if gu > g[u]:
+                continue # voce superata da un percorso migliore
+            if u not in exact:
+                exact.add(u)
+                full = gu + max(map(abs, map(sub, node_dist[u], dist_t)))
+                if full > f:
+                    push(heap, (full, neg_g, u))
+                    continue
+            if u == t:
+                self.expanded = expanded
+                path = []
+                while u is not None:
+                    path.append(self.nodes[u])
+                    u = parent[u]
+                path.reverse()
+                return path
+            expanded += 1
+            for v, w in neighbors[u]:
+                ng = gu + w
+                gv = g.get(v)
+                if gv is None or ng < gv:
+                    if closed_idx and (u, v) in closed_idx:
+                        continue
+                    g[v] = ng
+                    parent[v] = u
+                    h = best[v] - best_t
+                    push(heap, (ng + (h if h >= 0 else -h), -ng, v))
+        self.expanded = expanded
+        raise nx.NetworkXNoPath(f"No path between {source} and {target}.")
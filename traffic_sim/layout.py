@@ -0,0 +1,192 @@
+import hashlib
+import os
+import networkx as nx
+import numpy as np
+
+from utilities.Debug import debug
+
+DEBUG = False
+
+# Variabile d'ambiente con una cartella alternativa per la cache dei layout (vuota per disattivarla)
+LAYOUT_CACHE_ENV = "TRAFFIC_SIM_LAYOUT_CACHE"
+
+# Cartella nel repository, utilizzabile come alternativa tramite LAYOUT_CACHE_ENV o cache_dir
+REPO_LAYOUT_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".layout_cache")
+
+# Dimensione massima della cache su disco: oltre, vengono eliminati i layout usati meno di recente
+LAYOUT_CACHE_BYTES = 256 * 1024 * 1024
+
+# Cartella della cache: LAYOUT_CACHE_ENV se impostata, altrimenti la cache utente ($XDG_CACHE_HOME o ~/.cache)
+def layout_cache_dir():
+    override = os.environ.get(LAYOUT_CACHE_ENV)
+    if override is not None:
+        return override or None
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "traffic_sim", "layouts")
+
+# Cartella dei layout salvati su disco (None per disattivare la cache)
+LAYOUT_CACHE_DIR = layout_cache_dir()
+
+# Algoritmi di layout: spring (nx.spring_layout), fast (forze su griglia) o auto
+LAYOUT_METHODS = ("auto", "spring", "fast")
+
+# Con 'auto' i grafi da questo numero di nodi in su usano il layout 'fast'
+FAST_LAYOUT_NODES = 2000
+
+# Iterazioni e numero massimo di celle per lato della griglia del layout 'fast'
+FAST_ITERATIONS = 50
+FAST_GRID = 256
+
+# Impronta del grafo: nodi e archi nell'ordine di inserimento, più i parametri del layout
+def graph_hash(G, *params):
+    digest = hashlib.sha1()
+    digest.update(repr(list(G.nodes)).encode())
+    digest.update(repr(list(G.edges)).encode())
+    digest.update(repr(params).encode())
+    return digest.hexdigest()[:16]
+
+# Layout di G con posizioni in [center - scale, center + scale], letto dalla cache se già calcolato
+def cached_layout(G, mode, num_nodes, seed, method="auto", scale=1, center=(0, 0), cache_dir=LAYOUT_CACHE_DIR,
+                  max_bytes=LAYOUT_CACHE_BYTES):
+    """
+    La chiave è (mode, num_nodes, seed, hash del grafo): lo stesso grafo
+    generato di nuovo con lo stesso seme ritrova il layout su disco invece di
+    ricalcolarlo. Le posizioni sono salvate come array .npy nell'ordine di
+    G.nodes; la data di modifica dei file letti viene aggiornata, così
+    superati max_bytes si eliminano quelli usati meno di recente.
+    """
+    if method == "auto":
+        method = "fast" if G.number_of_nodes() >= FAST_LAYOUT_NODES else "spring"
+    if method not in LAYOUT_METHODS:
+        raise ValueError(f"Layout sconosciuto: {method}")
+    nodes = list(G.nodes)
+
+    path = None
+    if cache_dir is not None:
+        key = graph_hash(G, method, scale, tuple(center))
+        path = os.path.join(cache_dir, f"{mode}-{num_nodes}-{seed}-{method}-{key}.npy")
+        try:
+            coords = np.load(path)
+            if coords.shape == (len(nodes), 2):
+                os.utime(path) # usato di recente
+                if DEBUG:
+                    debug(f"layout letto dalla cache: {path}")
+                return dict(zip(nodes, map(tuple, coords.tolist())))
+        except (OSError, ValueError):
+            pass # assente o illeggibile: si ricalcola
+
+    if method == "spring":
+        pos = nx.spring_layout(G, scale=scale, center=center, seed=seed)
+    else:
+        pos = fast_layout(G, scale=scale, center=center, seed=seed)
+    coords = np.array([pos[n] for n in nodes], dtype=np.float64).reshape(len(nodes), 2)
+
+    if path is not None:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, coords)
+            os.replace(tmp_path, path) # un file a metà non è mai visibile con il nome definitivo
+            evict_layouts(cache_dir, max_bytes)
+        except OSError as e:
+            if DEBUG:
+                debug(f"impossibile salvare il layout: {e}")
+    # stesse tuple di float sia dal calcolo sia dalla cache
+    return dict(zip(nodes, map(tuple, coords.tolist())))
+
+# Elimina i layout meno usati di recente finché la cache non supera max_bytes
+def evict_layouts(cache_dir, max_bytes=LAYOUT_CACHE_BYTES):
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith(".npy") and entry.is_file():
+            try:
+                info = entry.stat()
+            except OSError:
+                continue # eliminato nel frattempo da un altro processo
+            entries.append((info.st_mtime, info.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+            if DEBUG:
+                debug(f"layout rimosso dalla cache: {path}")
+        except OSError:
+            pass
+
+# Layout a forze (Fruchterman-Reingold) vettoriale, con la repulsione calcolata su una griglia
+def fast_layout(G, scale=1, center=(0, 0), seed=None, iterations=FAST_ITERATIONS, grid=FAST_GRID):
+    """
+    Le attrazioni lungo gli archi sono calcolate in blocco con NumPy. La
+    repulsione tra tutte le coppie di nodi (O(n^2) in spring_layout) è
+    approssimata contando i nodi per cella di una griglia grid x grid e
+    convolvendo i conteggi con la forza k^2/d tramite FFT: ogni iterazione
+    costa O(n + grid^2 log grid). I nodi nella stessa cella non si respingono
+    tra loro: la griglia ha circa una cella per nodo, fino a grid celle per lato.
+    """
+    nodes = list(G.nodes)
+    n = len(nodes)
+    if n == 0:
+        return {}
+    if n == 1:
+        return {nodes[0]: tuple(np.asarray(center, dtype=np.float64).tolist())}
+
+    index = {node: i for i, node in enumerate(nodes)}
+    edges = np.array([(index[u], index[v]) for u, v in G.edges if u != v], dtype=np.int64).reshape(-1, 2)
+    src, dst = edges[:, 0], edges[:, 1]
+
+    # celle per lato: potenza di 2 vicina a sqrt(n), come la dimensione delle FFT
+    grid = min(grid, 1 << max(3, int(np.ceil(np.log2(np.sqrt(n))))))
+    fft_size = 1 << int(np.ceil(np.log2(3 * grid - 2))) # convoluzione lineare senza ricircolo
+
+    rng = np.random.default_rng(seed)
+    pos = rng.random((n, 2))
+    k = 1 / np.sqrt(n) # distanza ideale tra nodi nel quadrato unitario
+    t = 0.1 # temperatura: spostamento massimo per iterazione
+    dt = t / (iterations + 1)
+
+    # nucleo della repulsione su offset di cella (-grid+1 .. grid-1), in unità di cella
+    offsets = np.arange(-grid + 1, grid)
+    ox, oy = np.meshgrid(offsets, offsets, indexing="ij")
+    r2 = (ox * ox + oy * oy).astype(np.float64)
+    r2[grid - 1, grid - 1] = np.inf # nessuna forza della cella su se stessa
+    shape = (fft_size, fft_size)
+    kernel_x = np.fft.rfft2(ox / r2, shape)
+    kernel_y = np.fft.rfft2(oy / r2, shape)
+
+    for _ in range(iterations):
+        # conteggio dei nodi per cella
+        low = pos.min(axis=0)
+        extent = max((pos.max(axis=0) - low).max(), 1e-9)
+        cell = extent / grid
+        cx = np.minimum(((pos[:, 0] - low[0]) / cell).astype(np.int64), grid - 1)
+        cy = np.minimum(((pos[:, 1] - low[1]) / cell).astype(np.int64), grid - 1)
+        density = np.bincount(cx * grid + cy, minlength=grid * grid).reshape(grid, grid).astype(np.float64)
+
+        # repulsione: somma di k^2 * r / |r|^2 sulle celle (convoluzione via FFT)
+        density_f = np.fft.rfft2(density, shape)
+        field_x = np.fft.irfft2(density_f * kernel_x, shape)[grid - 1:2 * grid - 1, grid - 1:2 * grid - 1]
+        field_y = np.fft.irfft2(density_f * kernel_y, shape)[grid - 1:2 * grid - 1, grid - 1:2 * grid - 1]
+        disp = np.empty_like(pos)
+        disp[:, 0] = field_x[cx, cy] * (k * k / cell)
+        disp[:, 1] = field_y[cx, cy] * (k * k / cell)
+
+        # attrazione lungo gli archi: d^2 / k
+        delta = pos[src] - pos[dst]
+        pull = delta * (np.hypot(delta[:, 0], delta[:, 1]) / k)[:, None]
+        for axis in range(2):
+            disp[:, axis] -= np.bincount(src, weights=pull[:, axis], minlength=n)
+            disp[:, axis] += np.bincount(dst, weights=pull[:, axis], minlength=n)
+
+        # spostamento limitato dalla temperatura
+        length = np.maximum(np.hypot(disp[:, 0], disp[:, 1]), 0.01)
+        pos += disp * (np.minimum(length, t) / length)[:, None]
+        t -= dt
+
+    pos = nx.rescale_layout(pos, scale=scale) + np.asarray(center, dtype=np.float64)
+    if DEBUG:
+        debug(f"layout fast: {n} nodi, {len(src)} archi")
+    return dict(zip(nodes, map(tuple, pos.tolist())))
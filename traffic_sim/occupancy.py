@@ -0,0 +1,61 @@
+import numpy as np
+
+# Contatori di occupazione degli archi entranti nei semafori
+class EdgeOccupancy:
+    """
+    Per ogni arco entrante (u, node) di un semaforo conta gli agenti sulla
+    corsia che si trovano entro detection_radius dal nodo. I contatori sono
+    ricalcolati a ogni step con un unico passaggio vettoriale sull'AgentStore,
+    così ogni semaforo legge il proprio stato in O(grado) invece di scorrere
+    tutti gli agenti. Gli stessi contatori sono le lunghezze delle code.
+    """
+    def __init__(self, traffic_lights, pos):
+        self.slots = {} # arco entrante (u, node) -> indice
+        node_xy = []
+        radius = []
+        for node, tl in traffic_lights.items():
+            for edge in tl.incoming_edges:
+                self.slots[edge] = len(node_xy)
+                node_xy.append(pos[node])
+                radius.append(tl.detection_radius)
+        self.node_xy = np.array(node_xy, dtype=np.float64).reshape(-1, 2)
+        self.radius = np.array(radius, dtype=np.float64)
+        self.counts = np.zeros(len(self.slots), dtype=np.int64)
+
+        self._lanes = None # lista delle corsie dello store per cui è valido lane_slot
+        self.lane_slot = np.full(0, -1, dtype=np.int64) # id corsia -> indice (-1 se non entrante)
+
+    def _sync_lanes(self, store):
+        if self._lanes is not store.lanes:
+            self._lanes = store.lanes
+            self.lane_slot = np.full(0, -1, dtype=np.int64)
+        known = len(self.lane_slot)
+        if known < len(store.lanes):
+            new = [self.slots.get(lane[:2], -1) for lane in store.lanes[known:]]
+            self.lane_slot = np.concatenate((self.lane_slot, np.array(new, dtype=np.int64)))
+
+    # Ricalcola i contatori dalle posizioni correnti degli agenti
+    def update(self, store):
+        self._sync_lanes(store)
+        self.counts[:] = 0
+        if not self.slots:
+            return self.counts
+        n = store.size
+        edge = store.edge[:n]
+        rows = np.flatnonzero(edge >= 0)
+        slot = self.lane_slot[edge[rows]]
+        sensed = slot >= 0
+        rows, slot = rows[sensed], slot[sensed]
+        dist = np.hypot(store.x[rows] - self.node_xy[slot, 0], store.y[rows] - self.node_xy[slot, 1])
+        inside = slot[dist < self.radius[slot]]
+        self.counts = np.bincount(inside, minlength=len(self.slots))
+        return self.counts
+
+    # Numero di agenti rilevati sull'arco entrante
+    def count(self, edge):
+        slot = self.slots.get(edge)
+        return 0 if slot is None else int(self.counts[slot])
+
+    # Lunghezza delle code per ogni arco entrante
+    def queue_lengths(self):
+        return {edge: int(self.counts[slot]) for edge, slot in self.slots.items()}
@@ -0,0 +1,197 @@
+import multiprocessing as mp
+import random
+import time
+import math
+import numpy as np
+
+from traffic_sim.simulation import Simulation
+from utilities.Debug import debug
+
+DEBUG = False
+
+# Divide i nodi in num_regions strisce verticali con lo stesso numero di nodi
+def partition_graph(graph, pos, num_regions):
+    """
+    Restituisce {nodo: regione}. Le strisce seguono la coordinata x delle
+    posizioni, quindi sulle griglie di build_grid_graph ogni regione è un
+    blocco di colonne e gli archi di confine sono solo quelli orizzontali.
+    """
+    nodes = sorted(graph.nodes, key=lambda n: (pos[n][0], pos[n][1]))
+    region_of = {}
+    for i, node in enumerate(nodes):
+        region_of[node] = min(i * num_regions // len(nodes), num_regions - 1)
+    return region_of
+
+# Processo che simula una regione del grafo
+def _region_worker(conn, region, graph, pos, traffic_lights, region_of, seed, router_options, respawn_on_arrival):
+    """
+    Ogni corsia (u, v, side) appartiene alla regione del suo nodo di arrivo v:
+    così un semaforo e tutti i suoi archi entranti stanno nello stesso processo.
+    Ogni step è diviso in due messaggi: con 'step' la regione aggiorna semafori
+    e cambi di arco e restituisce al processo principale gli agenti entrati in
+    una corsia di un'altra regione; con 'advance' riceve quelli entrati nelle
+    sue corsie e muove tutti gli agenti, compresi i nuovi arrivati.
+    """
+    random.seed(seed)
+    sim = Simulation(router_options=router_options, respawn_on_arrival=respawn_on_arrival)
+    local_lights = {n: tl for n, tl in traffic_lights.items() if region_of[n] == region}
+    sim.set_graph(graph, pos, traffic_lights=local_lights)
+    lane_region = np.zeros(0, dtype=np.int64) # id corsia -> regione
+
+    while True:
+        msg = conn.recv()
+        if msg[0] == 'step':
+            _, dt, incoming = msg
+            for state in incoming:
+                sim.import_agent(state)
+            sim.begin_step(dt)
+
+            # agenti entrati in corsie di altre regioni
+            store = sim.store
+            if len(lane_region) < len(store.lanes):
+                new = [region_of[lane[1]] for lane in store.lanes[len(lane_region):]]
+                lane_region = np.concatenate((lane_region, np.array(new, dtype=np.int64)))
+            n = store.size
+            edge = store.edge[:n]
+            on_lane = np.flatnonzero(store.alive[:n] & (edge >= 0))
+            leaving = on_lane[lane_region[edge[on_lane]] != region]
+            agents = [store.agents[row] for row in leaving]
+            outgoing = [sim.export_agent(agent) for agent in agents]
+            sim.remove_agents(agents)
+            conn.send(outgoing)
+        elif msg[0] == 'advance':
+            _, dt, incoming = msg
+            for state in incoming:
+                sim.import_agent(state)
+            sim.finish_step(dt)
+            conn.send(len(sim.agents))
+        elif msg[0] == 'stop':
+            conn.send(len(sim.agents))
+            break
+    conn.close()
+
+# Simulazione partizionata in regioni, ognuna avanzata da un processo separato
+class ParallelSimulation:
+    """
+    Il grafo e gli agenti iniziali sono generati da una Simulation con lo
+    stesso seme della versione a processo singolo, poi le regioni vengono
+    avanzate in parallelo e gli agenti passano di regione agli archi di confine.
+    Le chiusure degli archi a simulazione avviata non sono supportate.
+    """
+    def __init__(self, num_regions=2, seed=None, router_options=None, respawn_on_arrival=False):
+        self.num_regions = num_regions
+        self.seed = seed
+        self.router_options = router_options or {}
+        self.respawn_on_arrival = respawn_on_arrival # passato alle Simulation delle regioni
+        self.sim = Simulation(seed=seed, router_options=self.router_options)
+        self.region_of = None
+        self.inbox = [[] for _ in range(num_regions)] # agenti da consegnare a ogni regione
+        self.agent_counts = [0] * num_regions
+        self.handoffs = 0 # agenti trasferiti tra regioni
+        self._workers = []
+
+    def generate_graph(self, mode, num_nodes, area_size=(1000, 800), layout="auto"):
+        G, pos = self.sim.generate_graph(mode, num_nodes, area_size, layout=layout)
+        self.region_of = partition_graph(G, pos, self.num_regions)
+        return G, pos
+
+    def spawn_agents(self, num_agents, speed_range=(40, 120), radius=5):
+        agents = self.sim.spawn_agents(num_agents, speed_range, radius)
+        for agent in agents:
+            state = self.sim.export_agent(agent)
+            self.inbox[self._owner(state)].append(state)
+        self.sim.remove_agents(agents)
+        return len(agents)
+
+    # Regione proprietaria della corsia su cui si trova l'agente
+    def _owner(self, state):
+        lane = state['lane']
+        node = lane[1] if lane is not None else state['path'][state['path_index']]
+        return self.region_of[node]
+
+    def start(self):
+        ctx = mp.get_context()
+        base_seed = self.seed if self.seed is not None else random.randint(0, 10**6)
+        for region in range(self.num_regions):
+            parent, child = ctx.Pipe()
+            proc = ctx.Process(target=_region_worker, daemon=True,
+                               args=(child, region, self.sim.graph, self.sim.pos, self.sim.traffic_lights,
+                                     self.region_of, base_seed + region, self.router_options,
+                                     self.respawn_on_arrival))
+            proc.start()
+            self._workers.append((proc, parent))
+
+    # Un tick: cambi di arco nelle regioni, consegna degli agenti di confine, movimento
+    def step(self, dt):
+        for region, (proc, conn) in enumerate(self._workers):
+            conn.send(('step', dt, self.inbox[region]))
+        self.inbox = [[] for _ in range(self.num_regions)]
+        arrivals = [[] for _ in range(self.num_regions)]
+        for proc, conn in self._workers:
+            outgoing = conn.recv()
+            self.handoffs += len(outgoing)
+            for state in outgoing:
+                arrivals[self._owner(state)].append(state)
+        # gli agenti trasferiti si muovono nella nuova regione già in questo tick
+        for region, (proc, conn) in enumerate(self._workers):
+            conn.send(('advance', dt, arrivals[region]))
+        for region, (proc, conn) in enumerate(self._workers):
+            self.agent_counts[region] = conn.recv()
+
+    def run(self, ticks, dt=1/60):
+        if not self._workers:
+            self.start()
+        start = time.perf_counter()
+        for _ in range(ticks):
+            self.step(dt)
+        elapsed = time.perf_counter() - start
+
+        num_agents = self.num_agents()
+        agent_steps = ticks * num_agents
+        return {
+            'ticks': ticks,
+            'agents': num_agents,
+            'agent_steps': agent_steps,
+            'sim_time': ticks * dt,
+            'wall_time': elapsed,
+            'agent_steps_per_sec': agent_steps / elapsed if elapsed > 0 else math.inf,
+            'regions': self.num_regions,
+            'agents_per_region': list(self.agent_counts),
+            'handoffs': self.handoffs,
+        }
+
+    def num_agents(self):
+        return sum(self.agent_counts) + sum(len(inbox) for inbox in self.inbox)
+
+    def stop(self):
+        for proc, conn in self._workers:
+            conn.send(('stop',))
+            conn.recv()
+            proc.join()
+        self._workers = []
+
+# Confronta la simulazione a processo singolo con quella partizionata sullo stesso seme
+def compare_speedup(mode, num_nodes, num_agents, ticks, num_regions, seed=0, dt=1/60, router_options=None,
+                    layout="auto", respawn_on_arrival=False):
+    single = Simulation(seed=seed, router_options=router_options, respawn_on_arrival=respawn_on_arrival)
+    single.generate_graph(mode, num_nodes, layout=layout)
+    single.spawn_agents(num_agents)
+    single_stats = single.run(ticks, dt)
+
+    parallel = ParallelSimulation(num_regions, seed=seed, router_options=router_options,
+                                  respawn_on_arrival=respawn_on_arrival)
+    parallel.generate_graph(mode, num_nodes, layout=layout)
+    parallel.spawn_agents(num_agents)
+    parallel.start()
+    try:
+        parallel_stats = parallel.run(ticks, dt)
+    finally:
+        parallel.stop()
+
+    if DEBUG:
+        debug("single:", single_stats, "parallel:", parallel_stats)
+    return {
+        'single': single_stats,
+        'parallel': parallel_stats,
+        'speedup': single_stats['wall_time'] / parallel_stats['wall_time'],
+    }
@@ -0,0 +1,532 @@
+import math
+import random
+from collections import OrderedDict
+import networkx as nx
+
+from utilities.Debug import debug
+from utilities.euclidean_distance import distanza_euclidea
+from traffic_sim.landmarks import LandmarkIndex, NUM_LANDMARKS
+
+DEBUG = False
+
+# Modalità con cui vengono esclusi gli archi chiusi, senza copiare il grafo:
+# 'view'   -> vista filtrata del grafo (nx.subgraph_view), ricerca BFS
+# 'weight' -> funzione peso che restituisce None (peso infinito) sugli archi chiusi, Dijkstra
+CLOSED_EDGE_MODES = ("view", "weight")
+
+# Algoritmi di ricerca disponibili:
+# 'bfs'   -> percorso con il minor numero di archi
+# 'astar' -> percorso più corto in lunghezza euclidea, A* con euristica in linea d'aria
+# 'alt'   -> come 'astar', con euristica ALT da landmark precalcolati (grafi grandi)
+# 'auto'  -> 'alt' sui grafi con almeno LARGE_GRAPH_NODES nodi (se pos è noto), altrimenti 'bfs'
+BACKENDS = ("bfs", "astar", "alt", "auto")
+
+# Grafi grandi: oltre questa soglia una BFS puntuale costa millisecondi (7 ms su una
+# griglia 100x100) e 'auto' sceglie ALT, i cui landmark si calcolano in 0.04 s a 2000
+# nodi e 0.4 s a 10000; anche i grafi small-world di core sono estratti diversamente
+LARGE_GRAPH_NODES = 2000
+
+# Numero minimo di richieste verso la stessa destinazione oltre il quale conviene
+# costruire l'albero dei predecessori di quella destinazione. Misurato sulle griglie
+# da 900 a 40000 nodi (benchmarks/bench_core.py, caso route_many): un albero costa
+# quanto 6-9 ricerche puntuali con 'bfs' e 'astar' e circa 3 con closed_mode='weight',
+# un rapporto che non cresce con il grafo perché anche le ricerche puntuali ne
+# visitano una frazione costante
+TREE_THRESHOLD = 8
+
+# Con 'alt' le ricerche puntuali visitano solo una fascia attorno al percorso e il
+# rapporto con il costo di un albero cresce come la radice dei nodi: circa
+# ALT_TREE_COST * sqrt(N) (37 a 900 nodi, 135 a 10000, 250 a 40000)
+ALT_TREE_COST = 1.3
+
+# Nodi totali massimi negli alberi in cache (ogni nodo occupa circa 100 byte tra albero e indice degli archi)
+TREE_CACHE_NODES = 500_000
+
+# Calcolo dei percorsi con cache LRU e invalidazione selettiva sugli archi chiusi
+class Router:
+    """
+    I percorsi sono memorizzati con chiave (sorgente, destinazione, versione),
+    dove la versione cresce a ogni cambio di stato di un arco. Quando un arco
+    si chiude vengono scartati solo i percorsi e gli alberi che lo usano; gli
+    altri passano alla nuova versione. Quando un arco si riapre vengono
+    scartati quelli calcolati mentre era chiuso, che potrebbero accorciarsi
+    passando di nuovo per l'arco: quelli calcolati prima della chiusura erano
+    minimi con l'arco aperto e restano tali.
+
+    Per le destinazioni richieste spesso (almeno tree_threshold() volte)
+    viene costruito un albero dei predecessori (BFS dalla destinazione) da cui
+    si legge il percorso di qualsiasi sorgente senza nuove ricerche. La cache
+    degli alberi è limitata dal numero totale di nodi (max_tree_nodes), non dal
+    numero di alberi, perché ogni albero è grande quanto il grafo.
+
+    Gli archi chiusi non vengono mai rimossi da una copia del grafo: a seconda
+    di closed_mode sono filtrati da una vista o esclusi dalla funzione peso.
+
+    Con backend='astar' (richiede pos) le lunghezze euclidee degli archi sono
+    calcolate una sola volta e le ricerche usano A* con distanza in linea d'aria;
+    in questo caso gli archi chiusi sono sempre esclusi tramite la funzione peso.
+    Con backend='auto' (il default) la scelta tra 'bfs' e 'alt' è rifatta per
+    ogni grafo installato, in base al numero di nodi.
+    Con backend='alt' le stesse lunghezze sono usate per precalcolare una sola
+    volta un LandmarkIndex; le ricerche puntuali usano A* con le stime dei
+    landmark, che restano valide anche con archi chiusi. Su grafi grandi un
+    albero di Dijkstra costa quanto molte ricerche ALT, quindi viene costruito
+    solo per gruppi numerosi di richieste in route_many.
+    """
+    def __init__(self, graph, max_routes=4096, max_tree_nodes=TREE_CACHE_NODES, closed_mode="view", backend="auto", pos=None,
+                 num_landmarks=NUM_LANDMARKS):
+        if closed_mode not in CLOSED_EDGE_MODES:
+            raise ValueError(f"closed_mode deve essere uno tra {CLOSED_EDGE_MODES}")
+        if backend not in BACKENDS:
+            raise ValueError(f"backend deve essere uno tra {BACKENDS}")
+        if backend in ("astar", "alt") and pos is None:
+            raise ValueError(f"il backend '{backend}' richiede le posizioni dei nodi (pos)")
+        self.max_routes = max_routes
+        self.max_tree_nodes = max_tree_nodes
+        self.closed_mode = closed_mode
+        self.backend_option = backend # backend richiesto ('auto' viene risolto in _reset)
+        self.pos = pos
+        self.num_landmarks = num_landmarks
+        self._reset(graph)
+
+    # Stato che dipende dal grafo: lunghezze, landmark, archi chiusi, cache e contatori
+    def _reset(self, graph):
+        self.graph = graph
+        self.backend = self.backend_option
+        if self.backend == "auto":
+            self.backend = "alt" if self.pos is not None and graph.number_of_nodes() >= LARGE_GRAPH_NODES else "bfs"
+        self.lengths = edge_lengths(graph, self.pos) if self.backend in ("astar", "alt") else None
+        self.landmarks = LandmarkIndex(graph, self.lengths, self.num_landmarks) if self.backend == "alt" else None
+
+        self.version = 0 # versione dell'insieme degli archi chiusi
+        self.closed = set() # archi chiusi, in entrambe le direzioni
+        self._routes = OrderedDict() # (s, t, versione) -> percorso
+        self._trees = OrderedDict() # (t, versione) -> {nodo: nodo successivo verso t}
+        self._route_edges = {} # arco -> {(s, t)} dei percorsi che lo usano
+        self._tree_edges = {} # arco -> {t} degli alberi che lo usano
+        self._tree_nodes = 0 # nodi totali negli alberi in cache
+        self._route_born = {} # (s, t) -> versione in cui è stato calcolato il percorso
+        self._tree_born = {} # t -> versione in cui è stato calcolato l'albero
+        self._closed_at = {} # arco chiuso -> versione da cui è chiuso
+        self._target_misses = OrderedDict() # t -> richieste mancate (al più max_routes destinazioni, LRU)
+        self._open_graph = None # vista del grafo senza archi chiusi
+        self._components = None # componenti connesse per la versione corrente
+
+        self.hits = 0
+        self.misses = 0
+        self.tree_hits = 0
+        self.tree_builds = 0 # alberi dei predecessori costruiti
+
+        for u, v, data in graph.edges(data=True):
+            if not data.get("is_open", True):
+                self.closed.add((u, v))
+                self.closed.add((v, u))
+
+    # Percorso più breve da source a target (solleva nx.NetworkXNoPath se non esiste)
+    def route(self, source, target, build_tree=True):
+        """Con build_tree=False una richiesta mancata non porta mai alla costruzione di un albero."""
+        key = (source, target, self.version)
+        path = self._routes.get(key)
+        if path is not None:
+            self._routes.move_to_end(key)
+            self.hits += 1
+            return list(path)
+
+        tree = self._trees.get((target, self.version))
+        if tree is not None:
+            self._trees.move_to_end((target, self.version))
+            path = self._path_from_tree(tree, source, target)
+            self.tree_hits += 1
+        else:
+            self.misses += 1
+            misses = self._count_miss(target)
+            if build_tree and self.landmarks is None and misses >= self.tree_threshold():
+                self.tree_builds += 1
+                tree = self.tree(target)
+                path = self._path_from_tree(tree, source, target)
+            elif self.backend == "alt":
+                path = self.landmarks.path(source, target, self.closed, self.version)
+            elif self.backend == "astar":
+                path = nx.astar_path(self.graph, source, target, heuristic=self.heuristic, weight=self.weight)
+            elif self.closed_mode == "weight":
+                path = nx.dijkstra_path(self.graph, source, target, weight=self.weight)
+            else:
+                path = self._bidirectional_bfs(source, target)
+
+        self._store_route(source, target, path)
+        return list(path)
+
+    # Richieste mancate verso target, compresa quella corrente
+    def _count_miss(self, target):
+        misses = self._target_misses.pop(target, 0) + 1
+        self._target_misses[target] = misses
+        if len(self._target_misses) > self.max_routes:
+            self._target_misses.popitem(last=False)
+        return misses
+
+    # Richieste verso la stessa destinazione da cui un albero costa meno delle ricerche puntuali
+    def tree_threshold(self):
+        if self.landmarks is not None:
+            return max(TREE_THRESHOLD, round(ALT_TREE_COST * math.sqrt(self.graph.number_of_nodes())))
+        return TREE_THRESHOLD
+
+    # Albero dei predecessori verso target: per ogni nodo, il nodo successivo sul percorso
+    def tree(self, target):
+        key = (target, self.version)
+        tree = self._trees.get(key)
+        if tree is not None:
+            self._trees.move_to_end(key)
+            return tree
+
+        if self.lengths is not None or self.closed_mode == "weight":
+            pred, _ = nx.dijkstra_predecessor_and_distance(self.graph, target, weight=self.weight)
+            tree_edges = ((preds[0], child) for child, preds in pred.items() if preds)
+        else:
+            tree_edges = self._bfs_edges(target)
+
+        tree = {target: None}
+        tree_index = self._tree_edges
+        for parent, child in tree_edges:
+            tree[child] = parent
+            tree_index.setdefault((child, parent), set()).add(target)
+            tree_index.setdefault((parent, child), set()).add(target)
+
+        self._trees[key] = tree
+        self._tree_born[target] = self.version
+        self._tree_nodes += len(tree)
+        self._target_misses.pop(target, None)
+        while self._tree_nodes > self.max_tree_nodes and len(self._trees) > 1:
+            (old_target, _), old_tree = self._trees.popitem(last=False)
+            self._forget_tree(old_target, old_tree)
+        return tree
+
+    # Archi (genitore, figlio) della BFS da source sugli archi aperti, nello stesso ordine di nx.bfs_edges
+    def _bfs_edges(self, source):
+        """
+        Scorre direttamente le adiacenze del grafo: la vista filtrata di nx
+        valuta il filtro su ogni arco con diverse chiamate Python ed è molto
+        più lenta su grafi grandi.
+        """
+        adj = self.graph._adj # dizionari di adiacenza senza le viste di nx
+        closed = self.closed
+        visited = {source}
+        frontier = [source]
+        while frontier:
+            next_frontier = []
+            for u in frontier:
+                for v in adj[u]:
+                    if v not in visited and (u, v) not in closed:
+                        visited.add(v)
+                        next_frontier.append(v)
+                        yield u, v
+            frontier = next_frontier
+
+    # Percorso con il minor numero di archi aperti, BFS bidirezionale sulle adiacenze del grafo
+    def _bidirectional_bfs(self, source, target):
+        if source == target:
+            return [source]
+        adj = self.graph._adj # dizionari di adiacenza senza le viste di nx
+        closed = self.closed
+        pred = {source: None} # nodo -> nodo precedente verso source
+        succ = {target: None} # nodo -> nodo successivo verso target
+        forward, backward = [source], [target]
+        meet = None
+        while forward and backward and meet is None:
+            # espande la frontiera più piccola
+            if len(forward) <= len(backward):
+                frontier, forward = forward, []
+                for u in frontier:
+                    for v in adj[u]:
+                        if v not in pred and (u, v) not in closed:
+                            pred[v] = u
+                            forward.append(v)
+                            if v in succ:
+                                meet = v
+                                break
+                    if meet is not None:
+                        break
+            else:
+                frontier, backward = backward, []
+                for u in frontier:
+                    for v in adj[u]:
+                        if v not in succ and (v, u) not in closed:
+                            succ[v] = u
+                            backward.append(v)
+                            if v in pred:
+                                meet = v
+                                break
+                    if meet is not None:
+                        break
+        if meet is None:
+            raise nx.NetworkXNoPath(f"No path between {source} and {target}.")
+        path = []
+        node = meet
+        while node is not None:
+            path.append(node)
+            node = pred[node]
+        path.reverse()
+        node = succ[meet]
+        while node is not None:
+            path.append(node)
+            node = succ[node]
+        return path
+
+    def _path_from_tree(self, tree, source, target):
+        if source not in tree:
+            raise nx.NetworkXNoPath(f"No path between {source} and {target}.")
+        path = [source]
+        while path[-1] != target:
+            path.append(tree[path[-1]])
+        return path
+
+    def _store_route(self, source, target, path):
+        self._routes[(source, target, self.version)] = tuple(path)
+        self._route_born[(source, target)] = self.version
+        for edge in zip(path, path[1:]):
+            self._route_edges.setdefault(edge, set()).add((source, target))
+        if len(self._routes) > self.max_routes:
+            (s, t, _), old_path = self._routes.popitem(last=False)
+            self._forget_route(s, t, old_path)
+
+    def _forget_route(self, source, target, path):
+        self._route_born.pop((source, target), None)
+        for edge in zip(path, path[1:]):
+            keys = self._route_edges.get(edge)
+            if keys is not None:
+                keys.discard((source, target))
+                if not keys:
+                    del self._route_edges[edge]
+
+    def _forget_tree(self, target, tree):
+        self._tree_nodes -= len(tree)
+        self._tree_born.pop(target, None)
+        for child, parent in tree.items():
+            if parent is None:
+                continue
+            for edge in ((child, parent), (parent, child)):
+                targets = self._tree_edges.get(edge)
+                if targets is not None:
+                    targets.discard(target)
+                    if not targets:
+                        del self._tree_edges[edge]
+
+    # Registra il nuovo stato dell'arco (u, v); invalida solo ciò che lo usa
+    def set_edge_state(self, u, v, is_open):
+        if ((u, v) not in self.closed) == is_open:
+            return False # nessun cambiamento
+
+        stale_routes = set()
+        stale_trees = set()
+        if is_open:
+            self.closed.discard((u, v))
+            self.closed.discard((v, u))
+            # percorsi e alberi calcolati con l'arco chiuso (0 se chiuso già nel grafo iniziale)
+            closed_at = self._closed_at.pop((u, v), 0)
+            self._closed_at.pop((v, u), None)
+            stale_routes = {key for key, born in self._route_born.items() if born >= closed_at}
+            stale_trees = {t for t, born in self._tree_born.items() if born >= closed_at}
+        else:
+            self.closed.add((u, v))
+            self.closed.add((v, u))
+            self._closed_at[(u, v)] = self._closed_at[(v, u)] = self.version + 1
+            for edge in ((u, v), (v, u)):
+                stale_routes |= self._route_edges.get(edge, set())
+                stale_trees |= self._tree_edges.get(edge, set())
+        if DEBUG:
+            debug(f"arco {(u, v)} -> is_open={is_open}: invalidati {len(stale_routes)} percorsi, {len(stale_trees)} alberi")
+
+        self.version += 1
+
+        routes = OrderedDict()
+        for (s, t, _), path in self._routes.items():
+            if (s, t) in stale_routes:
+                self._forget_route(s, t, path)
+            else:
+                routes[(s, t, self.version)] = path
+        self._routes = routes
+
+        trees = OrderedDict()
+        for (t, _), tree in self._trees.items():
+            if t in stale_trees:
+                self._forget_tree(t, tree)
+            else:
+                trees[(t, self.version)] = tree
+        self._trees = trees
+
+        self._open_graph = None
+        self._components = None
+        return True
+
+    # Archi chiusi e contenuto delle cache (usato da Simulation.snapshot)
+    def snapshot(self):
+        """
+        Percorsi e alberi sono condivisi, non copiati: non vengono mai
+        modificati dopo l'inserimento in cache. Salvare anche le cache rende
+        il ripristino esatto, perché a parità di lunghezza un percorso letto
+        dalla cache può differire da uno ricalcolato.
+        """
+        return {
+            'closed': set(self.closed),
+            'routes': [(s, t, path) for (s, t, _), path in self._routes.items()],
+            'trees': [(t, tree) for (t, _), tree in self._trees.items()],
+            'target_misses': dict(self._target_misses),
+        }
+
+    # Ripristina lo stato salvato da snapshot
+    def restore(self, state):
+        """
+        Le voci vengono registrate con una nuova versione, così non si
+        confondono con quelle create dopo lo snapshot (anche nel LandmarkIndex).
+        """
+        self.version += 1
+        self.closed = set(state['closed'])
+        # l'epoca di calcolo delle voci non è salvata: alla riapertura di un arco vengono scartate tutte
+        self._closed_at = {edge: self.version for edge in self.closed}
+        self._routes = OrderedDict()
+        self._route_edges = {}
+        self._route_born = {}
+        for s, t, path in state['routes']:
+            self._routes[(s, t, self.version)] = path
+            self._route_born[(s, t)] = self.version
+            for edge in zip(path, path[1:]):
+                self._route_edges.setdefault(edge, set()).add((s, t))
+        self._trees = OrderedDict()
+        self._tree_edges = {}
+        self._tree_nodes = 0
+        self._tree_born = {}
+        for t, tree in state['trees']:
+            self._trees[(t, self.version)] = tree
+            self._tree_born[t] = self.version
+            self._tree_nodes += len(tree)
+            for child, parent in tree.items():
+                if parent is not None:
+                    self._tree_edges.setdefault((child, parent), set()).add(t)
+                    self._tree_edges.setdefault((parent, child), set()).add(t)
+        self._target_misses = OrderedDict(state['target_misses'])
+        self._open_graph = None
+        self._components = None
+
+    # Allinea lo stato degli archi chiusi con l'attributo 'is_open' del grafo
+    def sync(self, graph):
+        """Restituisce gli archi che risultano chiusi da questa sincronizzazione."""
+        if graph is not self.graph:
+            self._reset(graph)
+            return sorted(self.closed, key=str)
+        newly_closed = []
+        for u, v, data in graph.edges(data=True):
+            is_open = data.get("is_open", True)
+            if self.set_edge_state(u, v, is_open) and not is_open:
+                newly_closed.append((u, v))
+        return newly_closed
+
+    # Vista del grafo senza gli archi chiusi (nessuna copia)
+    def open_graph(self):
+        if self._open_graph is None:
+            self._open_graph = open_edges_view(self.graph, self.closed) if self.closed else self.graph
+        return self._open_graph
+
+    # Funzione peso per nx: None esclude gli archi chiusi
+    def weight(self, u, v, data):
+        if (u, v) in self.closed:
+            return None
+        return self.lengths[(u, v)] if self.lengths is not None else 1
+
+    # Euristica di A*: distanza in linea d'aria (ammissibile con pesi euclidei)
+    def heuristic(self, u, v):
+        return distanza_euclidea(self.pos[u], self.pos[v])
+
+    # Coppia (start, end) casuale di nodi distinti collegati da un percorso
+    def random_pair(self):
+        """
+        Equivale a estrarre coppie casuali finché non se ne trova una connessa:
+        si sceglie una componente con probabilità proporzionale alle sue coppie.
+        """
+        if self._components is None:
+            self._components = [list(c) for c in nx.connected_components(self.open_graph()) if len(c) > 1]
+        if not self._components:
+            raise nx.NetworkXNoPath("Nessuna coppia di nodi collegati nel grafo.")
+        weights = [len(c) * (len(c) - 1) for c in self._components]
+        component = random.choices(self._components, weights=weights)[0]
+        return random.sample(component, 2)
+
+    # n coppie (start, end) casuali estratte in blocco, con la stessa distribuzione di random_pair
+    def random_pairs(self, n):
+        self.random_pair() # inizializza le componenti (o solleva NetworkXNoPath)
+        weights = [len(c) * (len(c) - 1) for c in self._components]
+        components = random.choices(self._components, weights=weights, k=n)
+        return [random.sample(component, 2) for component in components]
+
+    # Pianificazione in blocco: percorsi per una lista di coppie (sorgente, destinazione)
+    def route_many(self, pairs, min_group=None):
+        """
+        Le richieste vengono raggruppate per destinazione. Per ogni
+        destinazione con almeno min_group richieste (di default
+        tree_threshold(), il punto di pareggio misurato tra un albero e le
+        ricerche puntuali) si costruisce (o si riusa) un solo albero dei predecessori, cioè
+        l'albero dei cammini minimi inverso radicato nella destinazione, da cui
+        si leggono i percorsi di tutte le sorgenti; le altre destinazioni
+        passano da route(). Per le coppie non collegate restituisce None.
+        Le richieste servite da un albero costruito in questa chiamata contano
+        come miss (l'albero come tree_builds), solo quelle servite da un albero
+        già in cache come tree_hits: hit_rate misura il riuso della cache.
+        """
+        if min_group is None:
+            min_group = self.tree_threshold()
+        groups = {} # destinazione -> indici delle richieste
+        for i, (source, target) in enumerate(pairs):
+            groups.setdefault(target, []).append(i)
+
+        paths = [None] * len(pairs)
+        for target, indices in groups.items():
+            if len(indices) >= min_group:
+                fresh = (target, self.version) not in self._trees
+                if fresh:
+                    self.tree_builds += 1
+                tree = self.tree(target)
+                for i in indices:
+                    source = pairs[i][0]
+                    if source in tree:
+                        paths[i] = self._path_from_tree(tree, source, target)
+                        if fresh:
+                            self.misses += 1
+                        else:
+                            self.tree_hits += 1
+            else:
+                for i in indices:
+                    try:
+                        # una sola richiesta: una ricerca puntuale costa meno di un albero
+                        paths[i] = self.route(pairs[i][0], target, build_tree=False)
+                    except nx.NetworkXNoPath:
+                        pass
+        if DEBUG:
+            debug(f"route_many: {len(pairs)} richieste, {len(groups)} destinazioni")
+        return paths
+
+    # Contatori di utilizzo della cache
+    def stats(self):
+        lookups = self.hits + self.tree_hits + self.misses
+        return {
+            'hits': self.hits,
+            'tree_hits': self.tree_hits,
+            'misses': self.misses,
+            'tree_builds': self.tree_builds,
+            'hit_rate': (self.hits + self.tree_hits) / lookups if lookups else 0.0,
+            'routes': len(self._routes),
+            'trees': len(self._trees),
+            'tree_nodes': self._tree_nodes,
+            'version': self.version,
+        }
+
+
+# Vista in sola lettura del grafo senza gli archi in closed (coppie (u, v) in entrambe le direzioni)
+def open_edges_view(graph, closed):
+    return nx.subgraph_view(graph, filter_edge=lambda u, v: (u, v) not in closed)
+
+# Lunghezza euclidea di ogni arco, in entrambe le direzioni
+def edge_lengths(graph, pos):
+    lengths = {}
+    for u, v in graph.edges():
+        d = distanza_euclidea(pos[u], pos[v])
+        lengths[(u, v)] = d
+        lengths[(v, u)] = d
+    return lengths
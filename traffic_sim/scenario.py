@@ -0,0 +1,227 @@
+import gc
+import json
+import os
+import networkx as nx
+import numpy as np
+
+from traffic_sim.core import TrafficLightController
+from traffic_sim.simulation import Simulation
+from utilities.Debug import debug
+
+DEBUG = False
+
+# Intestazione del file: identificativo del formato e versione
+SCENARIO_MAGIC = b"TSIMSCN1"
+
+# Allineamento (in byte) di ogni array nel file, per poterlo leggere come vista senza copie
+ALIGNMENT = 64
+
+# Tipi di semaforo, salvati come indice in questa tupla
+LIGHT_TYPES = ("normal", "sensor_based")
+
+# Scenari in un file binario compatto, letto con memory mapping:
+#   SCENARIO_MAGIC | lunghezza dell'intestazione (uint64 little endian) |
+#   intestazione JSON | array NumPy grezzi, ognuno allineato ad ALIGNMENT byte.
+# L'intestazione contiene la modalità, i dati non numerici (tabella dei tipi di
+# nodo, nomi dei POI) e per ogni array dtype, forma e posizione nel file.
+# Archi, semafori e percorsi sono array di indici di nodo; le liste di lunghezza
+# variabile (archi entranti di un semaforo, percorso di un agente) sono in
+# formato CSR: valori concatenati più un array con l'inizio di ogni lista.
+
+# Codifica i nomi dei nodi: interi, coppie di interi (griglia) o, in generale, JSON
+def _encode_nodes(nodes):
+    if all(type(n) is int for n in nodes):
+        return "int", np.array(nodes, dtype=np.int64)
+    if all(type(n) is tuple and len(n) == 2 and type(n[0]) is int and type(n[1]) is int for n in nodes):
+        return "pair", np.array(nodes, dtype=np.int64).reshape(len(nodes), 2)
+    return "json", None
+
+def _decode_nodes(node_format, array, header):
+    if node_format == "int":
+        return array.tolist()
+    if node_format == "pair":
+        return list(map(tuple, array.tolist()))
+    # le tuple diventano liste in JSON: vengono ricostruite
+    return [tuple(_as_tuple(x) for x in n) if isinstance(n, list) else n for n in header["nodes"]]
+
+def _as_tuple(value):
+    return tuple(_as_tuple(x) for x in value) if isinstance(value, list) else value
+
+# Attributo booleano come intero: 1, 0 o -1 se il dato non ha l'attributo
+def _flag(data, key):
+    return int(data[key]) if key in data else -1
+
+# Liste di lunghezza variabile -> (valori concatenati, inizio di ogni lista)
+def _csr(lists, dtype=np.int32):
+    starts = np.zeros(len(lists) + 1, dtype=np.int64)
+    np.cumsum([len(values) for values in lists], out=starts[1:])
+    values = np.fromiter((x for values in lists for x in values), dtype=dtype, count=int(starts[-1]))
+    return values, starts
+
+# Salva grafo, posizioni, configurazione dei semafori e percorsi degli agenti della simulazione
+def save_scenario(sim, path):
+    G = sim.graph
+    if G is None:
+        raise RuntimeError("Nessun grafo da salvare")
+    nodes = list(G.nodes)
+    index = {node: i for i, node in enumerate(nodes)}
+    node_format, node_array = _encode_nodes(nodes)
+
+    header = {"mode": sim.mode, "node_format": node_format, "arrays": {}}
+    if node_format == "json":
+        header["nodes"] = nodes
+    arrays = {}
+    if node_array is not None:
+        arrays["nodes"] = node_array
+
+    # nodi: posizione, tipo (indice nella tabella), raggiungibilità, altri attributi (es. nome dei POI).
+    # Gli attributi assenti valgono -1
+    arrays["pos"] = np.array([sim.pos[n] for n in nodes], dtype=np.float64).reshape(len(nodes), 2)
+    tipi = {}
+    arrays["node_type"] = np.array([tipi.setdefault(G.nodes[n]["tipo"], len(tipi)) if "tipo" in G.nodes[n] else -1
+                                    for n in nodes], dtype=np.int16)
+    header["node_types"] = list(tipi)
+    arrays["node_reachable"] = np.array([_flag(G.nodes[n], "is_reachable") for n in nodes], dtype=np.int8)
+    header["node_attrs"] = {
+        str(i): {k: v for k, v in G.nodes[n].items() if k not in ("tipo", "is_reachable")}
+        for i, n in enumerate(nodes)
+        if any(k not in ("tipo", "is_reachable") for k in G.nodes[n])
+    }
+
+    # archi come coppie di indici, con lo stato aperto/chiuso
+    arrays["edges"] = np.array([(index[u], index[v]) for u, v in G.edges], dtype=np.int32).reshape(-1, 2)
+    arrays["edge_open"] = np.array([_flag(d, "is_open") for _, _, d in G.edges(data=True)], dtype=np.int8)
+
+    # semafori: configurazione e archi entranti (solo il nodo di partenza, l'arrivo è il semaforo)
+    lights = list(sim.traffic_lights.values())
+    arrays["light_node"] = np.array([index[tl.node] for tl in lights], dtype=np.int32)
+    arrays["light_times"] = np.array([(tl.green_time, tl.red_time, tl.detection_radius) for tl in lights],
+                                     dtype=np.float64).reshape(len(lights), 3)
+    arrays["light_type"] = np.array([LIGHT_TYPES.index(tl.type) for tl in lights], dtype=np.int8)
+    arrays["light_edges"], arrays["light_edge_start"] = _csr([[index[u] for u, _ in tl.incoming_edges] for tl in lights])
+
+    # agenti: percorso, colore, velocità e raggio
+    agents = sim.agents
+    arrays["route_nodes"], arrays["route_start"] = _csr([[index[n] for n in agent.path] for agent in agents])
+    arrays["agent_color"] = np.array([agent.color for agent in agents], dtype=np.uint8).reshape(len(agents), 3)
+    arrays["agent_speed"] = np.array([agent.speed for agent in agents], dtype=np.float64)
+    arrays["agent_radius"] = np.array([agent.radius for agent in agents], dtype=np.float64)
+
+    # posizioni degli array nel file, dopo l'intestazione
+    offset = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        arrays[name] = array
+        header["arrays"][name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+    header_bytes = json.dumps(header).encode()
+    data_start = -(-(len(SCENARIO_MAGIC) + 8 + len(header_bytes)) // ALIGNMENT) * ALIGNMENT
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(SCENARIO_MAGIC)
+        f.write(len(header_bytes).to_bytes(8, "little"))
+        f.write(header_bytes)
+        for name, array in arrays.items():
+            f.seek(data_start + header["arrays"][name]["offset"])
+            f.write(array.tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+    if DEBUG:
+        debug(f"scenario salvato in {path}: {len(nodes)} nodi, {len(arrays['edges'])} archi, {len(agents)} agenti")
+
+# Legge l'intestazione e restituisce gli array come viste sul file mappato in memoria
+def read_scenario(path):
+    with open(path, "rb") as f:
+        if f.read(len(SCENARIO_MAGIC)) != SCENARIO_MAGIC:
+            raise ValueError(f"{path} non è un file di scenario")
+        header_len = int.from_bytes(f.read(8), "little")
+        header = json.loads(f.read(header_len))
+    data_start = -(-(len(SCENARIO_MAGIC) + 8 + header_len) // ALIGNMENT) * ALIGNMENT
+
+    buffer = np.memmap(path, dtype=np.uint8, mode="r")
+    arrays = {}
+    for name, info in header["arrays"].items():
+        dtype = np.dtype(info["dtype"])
+        count = int(np.prod(info["shape"]))
+        start = data_start + info["offset"]
+        arrays[name] = buffer[start:start + count * dtype.itemsize].view(dtype).reshape(info["shape"])
+    return header, arrays
+
+# Grafo, posizioni e semafori dagli array di uno scenario
+def build_network(header, arrays):
+    nodes = _decode_nodes(header["node_format"], arrays.get("nodes"), header)
+    node = nodes.__getitem__
+    tipi = header["node_types"]
+    types = arrays["node_type"].tolist()
+    reachable = arrays["node_reachable"].tolist()
+    is_open = arrays["edge_open"].tolist()
+
+    G = nx.Graph()
+    # dizionari degli attributi creati in blocco; il caso generale solo se qualche attributo mancava
+    if min(types, default=0) >= 0 and min(reachable, default=0) >= 0:
+        node_data = [{"tipo": tipi[t], "is_reachable": r == 1} for t, r in zip(types, reachable)]
+    else:
+        node_data = [{**({"tipo": tipi[t]} if t >= 0 else {}), **({"is_reachable": r == 1} if r >= 0 else {})}
+                     for t, r in zip(types, reachable)]
+    for i, attrs in header["node_attrs"].items():
+        node_data[int(i)].update(attrs)
+    G.add_nodes_from(zip(nodes, node_data))
+    if min(is_open, default=0) >= 0:
+        edge_data = [{"is_open": o == 1} for o in is_open]
+    else:
+        edge_data = [{"is_open": o == 1} if o >= 0 else {} for o in is_open]
+    edges = arrays["edges"]
+    G.add_edges_from(zip(map(node, edges[:, 0].tolist()), map(node, edges[:, 1].tolist()), edge_data))
+    pos = dict(zip(nodes, map(tuple, arrays["pos"].tolist())))
+
+    traffic_lights = {}
+    starts = arrays["light_edge_start"].tolist()
+    light_edges = list(map(node, arrays["light_edges"].tolist()))
+    for i, (n, (green, red, radius), t) in enumerate(zip(map(node, arrays["light_node"].tolist()),
+                                                         arrays["light_times"].tolist(), arrays["light_type"].tolist())):
+        incoming_edges = [(u, n) for u in light_edges[starts[i]:starts[i + 1]]]
+        traffic_lights[n] = TrafficLightController(n, incoming_edges, green_time=green, red_time=red,
+                                                   detection_radius=radius, type=LIGHT_TYPES[t])
+    return nodes, G, pos, traffic_lights
+
+# Ricostruisce uno scenario salvato con save_scenario in una simulazione (nuova se sim è None)
+def load_scenario(path, sim=None):
+    """
+    Il file viene mappato in memoria, quindi il costo è quello di creare gli
+    oggetti Python (grafo networkx, semafori, agenti). Durante la creazione il
+    garbage collector ciclico è sospeso: con centinaia di migliaia di nuovi
+    dizionari le sue passate periodiche raddoppierebbero il tempo di caricamento.
+    """
+    header, arrays = read_scenario(path)
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        nodes, G, pos, traffic_lights = build_network(header, arrays)
+        if sim is None:
+            sim = Simulation()
+        sim.remove_agents(list(sim.agents))
+        sim.set_graph(G, pos, traffic_lights=traffic_lights, mode=header["mode"])
+
+        # agenti con i percorsi salvati
+        starts = arrays["route_start"].tolist()
+        route_nodes = list(map(nodes.__getitem__, arrays["route_nodes"].tolist()))
+        colors = arrays["agent_color"].tolist()
+        sim.store.reserve(sim.store.size + len(colors))
+        new_agents = []
+        for i, (color, speed, radius) in enumerate(zip(colors, arrays["agent_speed"].tolist(), arrays["agent_radius"].tolist())):
+            agent = sim._make_agent(tuple(color), speed, radius, path=route_nodes[starts[i]:starts[i + 1]])
+            agent.start_path(sim.pos)
+            new_agents.append(agent)
+        sim.agents.extend(new_agents)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    if new_agents:
+        with sim.lock:
+            sim.shared_data['spawned'] = True
+        sim.publish_agents()
+
+    if DEBUG:
+        debug(f"scenario caricato da {path}: {len(nodes)} nodi, {len(G.edges)} archi, {len(new_agents)} agenti")
+    return sim
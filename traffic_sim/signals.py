@@ -0,0 +1,77 @@
+import heapq
+import numpy as np
+
+from utilities.Debug import debug
+
+DEBUG = False
+
+# Tolleranza sul confronto tra istanti simulati (somme di dt in virgola mobile)
+TIME_EPS = 1e-9
+
+# Cambi di fase dei semafori come eventi a tempo assoluto in una coda con priorità
+class SignalScheduler:
+    """
+    Invece di sommare dt al timer di ogni semaforo a ogni step, per ognuno
+    viene messo in coda (heap) l'istante simulato del prossimo cambio di fase,
+    phase_start + green_time. A ogni step si svegliano solo:
+    - i semafori il cui cambio di fase è scaduto;
+    - i semafori con un sensore attivo, cioè con agenti rilevati su un solo
+      arco entrante, letti dai contatori EdgeOccupancy in un passaggio vettoriale.
+    Una richiesta di priorità sposta solo phase_start: la voce già in coda
+    diventa obsoleta e viene rimessa all'istante corretto quando viene estratta.
+    Il comportamento è lo stesso di TrafficLightController.update, a meno di
+    un tick di differenza sui cambi di fase dovuto agli arrotondamenti (qui si
+    confrontano istanti assoluti invece di sommare dt al timer).
+    """
+    def __init__(self, traffic_lights, occupancy, now=0.0):
+        self.lights = [tl for tl in traffic_lights.values() if tl.incoming_edges]
+        self.occupancy = occupancy
+        self.queue = [] # heap di (istante del cambio di fase, indice del semaforo)
+
+        # indice EdgeOccupancy dell'arco entrante -> semaforo e arco
+        self.slot_light = np.zeros(len(occupancy.slots), dtype=np.int64)
+        self.slot_edge = [None] * len(occupancy.slots)
+        for i, tl in enumerate(self.lights):
+            tl.phase_start = now - tl.timer # conserva la parte di fase già trascorsa
+            heapq.heappush(self.queue, (tl.phase_start + tl.green_time, i))
+            for edge in tl.incoming_edges:
+                slot = occupancy.slots[edge]
+                self.slot_light[slot] = i
+                self.slot_edge[slot] = edge
+
+        self.wakeups = 0 # semafori svegliati (sensore o cambio di fase)
+
+    # Applica gli eventi fino all'istante now (tempo simulato alla fine dello step)
+    def update(self, now):
+        """Restituisce True se almeno un semaforo ha cambiato colori."""
+        changed = False
+
+        # sensori: semafori con traffico rilevato su un solo arco entrante
+        counts = self.occupancy.counts
+        if len(counts):
+            detected = counts > 0
+            per_light = np.bincount(self.slot_light[detected], minlength=len(self.lights))
+            for slot in np.flatnonzero(detected & (per_light[self.slot_light] == 1)):
+                tl = self.lights[self.slot_light[slot]]
+                changed |= tl.give_priority(self.slot_edge[slot])
+                tl.phase_start = now
+                self.wakeups += 1
+
+        # cambi di fase scaduti
+        while self.queue and self.queue[0][0] <= now + TIME_EPS:
+            due, i = heapq.heappop(self.queue)
+            tl = self.lights[i]
+            actual = tl.phase_start + tl.green_time
+            if actual > due + TIME_EPS:
+                # fase riavviata da un sensore dopo l'inserimento in coda
+                heapq.heappush(self.queue, (actual, i))
+                continue
+            tl.next_phase()
+            tl.phase_start = now
+            heapq.heappush(self.queue, (now + tl.green_time, i))
+            self.wakeups += 1
+            changed = True
+            if DEBUG:
+                debug(f"semaforo {tl.node}: verde a {tl.incoming_edges[tl.current_green_index]} (t={now:.2f})")
+        return changed
+
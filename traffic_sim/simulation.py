@@ -0,0 +1,469 @@
+import random
+import threading
+import time
+import math
+import numpy as np
+
+from traffic_sim.core import Agent, gen_graph, PRE_DEFINED_POS
+from traffic_sim.layout import cached_layout
+from traffic_sim.agent_store import AgentStore
+from traffic_sim.routing import Router
+from traffic_sim.occupancy import EdgeOccupancy
+from traffic_sim.signals import SignalScheduler
+from utilities.Debug import debug
+
+DEBUG = False
+
+# Colori fissi dei primi agenti generati (gli altri sono casuali)
+BASE_COLORS = [(255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 0)]
+
+# Crea il dizionario condiviso tra il motore, la GUI pygame e le finestre tkinter
+def make_shared_data():
+    return {
+        "paused": False,
+        "spawned": False,
+        "graph_generated": False,
+        "running": True,
+        "agents": {},
+        "info_win_is_open": False,
+        "edge_state_win_is_open": False,
+        "graph": None,
+        "pos": None,
+        "graph_changed": False,
+        "closed_edge_set": set(),
+        "updated_edge_set": False,
+        "queue_lengths": {},
+    }
+
+def normalize(value, min_val, max_val):
+    return 2 * (value - min_val) / (max_val - min_val) - 1
+
+# Motore di simulazione indipendente dalla visualizzazione
+class Simulation:
+    """
+    Possiede grafo, posizioni, agenti e semafori ed espone step(dt) / run(ticks).
+    La GUI pygame è solo una vista su questo motore; senza GUI può essere
+    eseguito headless alla velocità massima consentita dalla CPU.
+    Con respawn_on_arrival=True un agente che termina il percorso viene
+    rimosso e sostituito da un nuovo agente (nuovo id) preso dal pool degli
+    agenti rimossi, invece di ripartire con un nuovo percorso.
+    """
+    def __init__(self, shared_data=None, lock=None, seed=None, router_options=None, respawn_on_arrival=False):
+        self.shared_data = shared_data if shared_data is not None else make_shared_data()
+        self.lock = lock if lock is not None else threading.Lock()
+        if seed is not None:
+            random.seed(seed)
+        self.seed = seed
+
+        self.graph = None
+        self.pos = None
+        self.mode = None
+        self.agents = [] # lista di agenti
+        self.agent_pool = [] # agenti rimossi, riutilizzati al posto di allocarne di nuovi
+        self.respawn_on_arrival = respawn_on_arrival
+        self.completed_trips = 0 # percorsi portati a termine
+        self.store = AgentStore() # stato vettoriale degli agenti
+        self.router = None # cache dei percorsi sul grafo corrente
+        self.router_options = router_options or {} # parametri passati a Router
+        self.traffic_lights = {} # dizionario per i semafori
+        self.occupancy = None # contatori degli archi entranti nei semafori
+        self.signals = None # coda degli eventi dei semafori
+        self._lane_red = None # corsie con il rosso, ricalcolate solo quando un semaforo cambia
+        self._lights_changed = False # esito dell'aggiornamento dei semafori tra begin_step e finish_step
+
+        self.sim_time = 0.0 # tempo simulato in secondi
+        self.ticks = 0 # numero di step eseguiti
+        self._handled_closed = set() # archi chiusi già notificati agli agenti
+
+    # Genera il grafo e le posizioni dei nodi per la modalità richiesta
+    def generate_graph(self, mode, num_nodes, area_size=(1000, 800), layout="auto"):
+        """
+        area_size = (w, h) dell'area di simulazione, usata dai layout spring.
+        layout sceglie l'algoritmo per 'random' e 'ring_road' (vedi
+        traffic_sim.layout): i layout calcolati sono salvati su disco.
+        Se ci sono già agenti, vengono riassegnati a un nuovo percorso.
+        """
+        width, height = area_size
+        self.traffic_lights.clear()
+
+        if mode == 'grid':
+            G, pos = gen_graph(num_nodes, mode, self.traffic_lights)
+        elif mode == 'random':
+            G = gen_graph(num_nodes, mode, self.traffic_lights)
+            pos = cached_layout(G, mode, num_nodes, random.randint(0, 1000), method=layout,
+                                scale=width/2, center=((width-20)/2, (height-60)/2))
+            pos = {n: (x*2, y*2) for n, (x, y) in pos.items()}  # scala le posizioni per una migliore visibilità
+        elif mode == 'pre_defined':
+            G = gen_graph(num_nodes, mode, self.traffic_lights)
+            pos = dict(PRE_DEFINED_POS)
+        elif mode == 'ring_road':
+            G, pos = gen_graph(num_nodes, mode, self.traffic_lights, layout=layout)
+        else:
+            raise ValueError(f"Modalità di generazione sconosciuta: {mode}")
+
+        self.set_graph(G, pos, mode=mode)
+        return G, pos
+
+    # Installa un grafo già costruito (con le sue posizioni e i suoi semafori)
+    def set_graph(self, G, pos, traffic_lights=None, mode=None):
+        if traffic_lights is not None:
+            self.traffic_lights = traffic_lights
+        self.graph = G
+        self.pos = pos
+        self.mode = mode
+        self.router = Router(G, pos=pos, **self.router_options)
+        self.occupancy = EdgeOccupancy(self.traffic_lights, pos)
+        for tl in self.traffic_lights.values():
+            tl.occupancy = self.occupancy
+        self.signals = SignalScheduler(self.traffic_lights, self.occupancy, now=self.sim_time)
+        self._lane_red = None
+
+        xs = np.array([v[0] for v in pos.values()])
+        ys = np.array([v[1] for v in pos.values()])
+        x_min, x_max = xs.min(), xs.max()
+        y_min, y_max = ys.min(), ys.max()
+        pos_norm = {
+            k: (normalize(v[0], x_min, x_max), normalize(v[1], y_min, y_max))
+            for k, v in pos.items()
+        }
+
+        with self.lock:
+            self.shared_data['graph'] = G
+            self.shared_data['pos'] = pos_norm
+            self.shared_data['graph_generated'] = True
+            self.shared_data['closed_edge_set'].clear()
+        self._handled_closed.clear()
+
+        self.store.clear_lanes()
+        for agent in self.agents:
+            agent.router = self.router
+            agent.current_target = None
+            agent.new_path(self.graph, self.pos)
+
+    # Crea num_agents agenti sul grafo corrente
+    def spawn_agents(self, num_agents, speed_range=(40, 120), radius=5):
+        """
+        Creazione in blocco: le coppie origine/destinazione vengono estratte
+        tutte insieme e i percorsi calcolati raggruppati per destinazione,
+        quindi il costo cresce circa linearmente con num_agents (anche 10k+).
+        """
+        if self.graph is None:
+            raise RuntimeError("Generare il grafo prima di creare gli agenti")
+
+        colors = BASE_COLORS[:num_agents]
+        for _ in range(num_agents - len(colors)):
+            colors.append((random.randint(0,255), random.randint(0,255), random.randint(0,255)))
+        specs = [(color, random.randint(*speed_range), radius) for color in colors]
+        new_agents = self._spawn_batch(specs)
+
+        with self.lock:
+            self.shared_data['spawned'] = True
+        self.publish_agents()
+        return new_agents
+
+    # Crea un agente per ogni (colore, velocità, raggio) con percorsi pianificati in blocco
+    def _spawn_batch(self, specs):
+        paths = self.router.route_many(self.router.random_pairs(len(specs)))
+        self.store.reserve(self.store.size + len(specs))
+        new_agents = []
+        for (color, speed, radius), path in zip(specs, paths):
+            agent = self._make_agent(color, speed, radius, path=path)
+            agent.start_path(self.pos)
+            new_agents.append(agent)
+        self.agents.extend(new_agents)
+        return new_agents
+
+    # Assegna un nuovo viaggio casuale agli agenti arrivati, pianificando i percorsi in blocco
+    def _new_trips(self, agents):
+        paths = self.router.route_many(self.router.random_pairs(len(agents)))
+        for agent, path in zip(agents, paths):
+            agent.path = path
+            agent.path_index = 0
+            agent.start_path(self.pos)
+
+    # Nuovo agente sul grafo corrente, riutilizzando se possibile un agente del pool
+    def _make_agent(self, color, speed, radius, path=None):
+        if self.agent_pool:
+            agent = self.agent_pool.pop()
+            agent.respawn(color, self.graph, self.pos, speed, radius, self.router, path)
+            return agent
+        return Agent(color, self.graph, self.pos, lock=self.lock, shared_data=self.shared_data,
+                     speed=speed, radius=radius, store=self.store, router=self.router, path=path)
+
+    # Stato completo di un agente, serializzabile (es. per trasferirlo a un altro processo)
+    def export_agent(self, agent):
+        return {
+            'id': agent.id,
+            'color': agent.color,
+            'speed': float(agent.speed),
+            'radius': float(agent.radius),
+            'path': list(agent.path),
+            'path_index': agent.path_index,
+            'x': float(agent.x),
+            'y': float(agent.y),
+            'actual_speed': float(agent.actual_speed),
+            'dir': (float(agent.dir_x), float(agent.dir_y)),
+            'angle': float(agent.angle),
+            'target': agent.current_target and tuple(map(float, agent.current_target)),
+            'lane': agent.current_edge_nodes,
+        }
+
+    # Ricrea un agente a partire dallo stato restituito da export_agent
+    def import_agent(self, state):
+        agent = self._make_agent(state['color'], state['speed'], state['radius'], path=state['path'])
+        agent.id = state['id']
+        agent.path_index = state['path_index']
+        agent.x, agent.y = state['x'], state['y']
+        agent.prev_x, agent.prev_y = state['x'], state['y']
+        agent.actual_speed = state['actual_speed']
+        agent.dir_x, agent.dir_y = state['dir']
+        agent.angle = state['angle']
+        agent.current_target = state['target']
+        agent.current_edge_nodes = state['lane']
+        self.agents.append(agent)
+        return agent
+
+    # Rimuove gli agenti dalla simulazione liberando le loro righe nello store
+    def remove_agents(self, agents):
+        removed = set()
+        for agent in agents:
+            self.store.remove(agent.row)
+            removed.add(agent)
+            self.agent_pool.append(agent)
+        self.agents = [agent for agent in self.agents if agent not in removed]
+        with self.lock:
+            for agent in removed:
+                self.shared_data["agents"].pop(agent, None)
+
+    # Checkpoint in memoria dello stato completo della simulazione
+    def snapshot(self):
+        """
+        Contiene agenti (righe dello store, percorso e path_index), stato dei
+        semafori e della coda degli eventi, archi chiusi, tempo simulato e stato
+        dei generatori casuali. Gli array sono copiati in blocco e i percorsi
+        condivisi (non vengono mai modificati sul posto), quindi lo snapshot
+        costa poco anche a intervalli di pochi secondi simulati. Lo stesso
+        snapshot può essere ripristinato più volte con restore, ad esempio per
+        provare varianti diverse dallo stesso istante.
+        """
+        if self.graph is None:
+            raise RuntimeError("Generare il grafo prima di salvare uno snapshot")
+        with self.lock:
+            shared = {
+                'closed_edge_set': set(self.shared_data['closed_edge_set']),
+                'updated_edge_set': self.shared_data['updated_edge_set'],
+            }
+        return {
+            'graph': self.graph,
+            'pos': self.pos,
+            'mode': self.mode,
+            'traffic_lights': self.traffic_lights,
+            'router': self.router.snapshot(),
+            'store': self.store.snapshot(),
+            'agents': [(agent, agent.id, agent.row, agent.path, agent.color) for agent in self.agents],
+            'agent_pool': list(self.agent_pool),
+            'next_agent_id': Agent._id_agent,
+            'lights': [(tl, tl.timer, tl.current_green_index, dict(tl.lights), tl.priority_edge, tl.phase_start)
+                       for tl in self.traffic_lights.values()],
+            'signal_queue': list(self.signals.queue),
+            'signal_wakeups': self.signals.wakeups,
+            'occupancy_counts': self.occupancy.counts.copy(),
+            'shared': shared,
+            'handled_closed': set(self._handled_closed),
+            'sim_time': self.sim_time,
+            'ticks': self.ticks,
+            'completed_trips': self.completed_trips,
+            'random_state': random.getstate(),
+            'np_random_state': np.random.get_state(),
+        }
+
+    # Riporta la simulazione allo stato di uno snapshot
+    def restore(self, snapshot):
+        """
+        Gli archi chiusi o riaperti dopo lo snapshot tornano allo stato salvato
+        sia nel grafo sia nel Router, insieme alle cache dei percorsi. Gli
+        agenti creati dopo lo snapshot vengono scartati.
+        """
+        if snapshot['graph'] is not self.graph:
+            self.set_graph(snapshot['graph'], snapshot['pos'], traffic_lights=snapshot['traffic_lights'],
+                           mode=snapshot['mode'])
+
+        # archi chiusi: il grafo viene aggiornato solo per gli archi cambiati dopo lo snapshot
+        saved_closed = snapshot['router']['closed']
+        for u, v in self.router.closed ^ saved_closed:
+            if self.graph.has_edge(u, v):
+                self.graph[u][v]['is_open'] = (u, v) not in saved_closed
+        self.router.restore(snapshot['router'])
+
+        # agenti: ogni oggetto torna sulla sua riga con id, percorso e colore salvati
+        for agent, agent_id, row, path, color in snapshot['agents']:
+            agent.id = agent_id
+            agent.row = row
+            agent._path = path
+            agent.color = color
+            agent.store = self.store
+            agent.router = self.router
+        self.store.restore(snapshot['store'], self.graph)
+        self.agents = [agent for agent, *_ in snapshot['agents']]
+        self.agent_pool = list(snapshot['agent_pool'])
+        Agent._id_agent = snapshot['next_agent_id']
+
+        for tl, timer, green_index, lights, priority_edge, phase_start in snapshot['lights']:
+            tl.timer = timer
+            tl.current_green_index = green_index
+            tl.lights = dict(lights)
+            tl.priority_edge = priority_edge
+            tl.phase_start = phase_start
+        self.signals.queue = list(snapshot['signal_queue'])
+        self.signals.wakeups = snapshot['signal_wakeups']
+        self.occupancy.counts = snapshot['occupancy_counts'].copy()
+        self._lane_red = None
+
+        alive = set(self.agents)
+        with self.lock:
+            # stesso insieme condiviso: gli agenti lo leggono per riferimento
+            self.shared_data['closed_edge_set'].clear()
+            self.shared_data['closed_edge_set'].update(snapshot['shared']['closed_edge_set'])
+            self.shared_data['updated_edge_set'] = snapshot['shared']['updated_edge_set']
+            for agent in [agent for agent in self.shared_data['agents'] if agent not in alive]:
+                del self.shared_data['agents'][agent]
+        self._handled_closed = set(snapshot['handled_closed'])
+
+        self.sim_time = snapshot['sim_time']
+        self.ticks = snapshot['ticks']
+        self.completed_trips = snapshot['completed_trips']
+        random.setstate(snapshot['random_state'])
+        np.random.set_state(snapshot['np_random_state'])
+
+    # Applica le modifiche al grafo arrivate dalle finestre tkinter e dagli agenti
+    def sync_shared_state(self):
+        """
+        Gli archi chiusi dall'ultima chiamata (delta) vengono consumati una sola
+        volta: si ripianificano solo gli agenti il cui percorso restante li usa.
+        """
+        newly_closed = set()
+        with self.lock:
+            if self.shared_data['graph_changed']:
+                self.graph = self.shared_data['graph']
+                self.shared_data['graph_changed'] = False
+                self.store.refresh_lane_state(self.graph)
+                newly_closed.update(self.router.sync(self.graph))
+            closed_edge_set = self.shared_data['closed_edge_set']
+            self._handled_closed &= closed_edge_set
+            if self.shared_data['updated_edge_set']:
+                newly_closed.update(closed_edge_set - self._handled_closed)
+                self._handled_closed |= closed_edge_set
+                self.shared_data['updated_edge_set'] = False
+
+        rerouted = set()
+        for u, v in newly_closed:
+            rerouted.update(self.store.rows_on_route(u, v))
+
+        # ripianificazione in blocco: un solo albero per ogni destinazione condivisa
+        requests = []
+        for row in sorted(rerouted):
+            agent = self.store.agents[row]
+            request = agent.reroute_request()
+            if request is not None:
+                requests.append((agent, request))
+        tails = self.router.route_many([(start, target) for _, (keep, start, target) in requests])
+        for (agent, (keep, start, target)), tail in zip(requests, tails):
+            agent.apply_reroute(self.graph, self.pos, keep, tail)
+        if DEBUG and newly_closed:
+            debug(f"archi chiusi {newly_closed}: ripianificati {len(rerouted)} agenti")
+        return rerouted
+
+    # Avanza la simulazione di dt secondi simulati
+    def step(self, dt):
+        self.begin_step(dt)
+        self.finish_step(dt)
+
+    # Prima metà dello step: semafori e cambi di arco, senza muovere gli agenti
+    def begin_step(self, dt):
+        """
+        Separata da finish_step perché la simulazione a regioni possa
+        trasferire gli agenti appena entrati in una corsia di un'altra regione
+        prima del movimento, che avviene così nello stesso step.
+        """
+        self.sync_shared_state()
+
+        store = self.store
+        self.occupancy.update(store)
+        # si svegliano solo i semafori con un cambio di fase scaduto o un sensore attivo
+        self._lights_changed = self.signals.update(self.sim_time + dt)
+
+        store.save_prev_positions()
+
+        # logica per-agente solo per chi cambia arco, termina il percorso o trova l'arco chiuso
+        finished = []
+        for row in store.pending_rows():
+            agent = store.agents[row]
+            if agent.path_index < len(agent.path) - 1:
+                agent.prepare_edge(self.graph, self.pos)
+            else:
+                finished.append(agent)
+        if finished:
+            # nuovi percorsi pianificati in blocco per tutti gli agenti arrivati in questo step
+            self.completed_trips += len(finished)
+            if self.respawn_on_arrival:
+                self._respawn_finished(finished)
+            else:
+                self._new_trips(finished)
+
+    # Seconda metà dello step: movimento vettoriale di tutti gli agenti
+    def finish_step(self, dt):
+        store = self.store
+        if self._lights_changed or self._lane_red is None or len(self._lane_red) != len(store.lanes):
+            self._lane_red = store.red_lanes(self.traffic_lights)
+
+        # movimento di tutti gli agenti in un unico passaggio vettoriale
+        store.advance(dt, self._lane_red)
+        store.update_actual_speed(dt)
+
+        self.sim_time += dt
+        self.ticks += 1
+
+    # Sostituisce gli agenti arrivati con nuovi agenti dello stesso tipo presi dal pool
+    def _respawn_finished(self, finished):
+        specs = [(agent.color, float(agent.speed), float(agent.radius)) for agent in finished]
+        self.remove_agents(finished)
+        self._spawn_batch(specs)
+
+    # Esegue ticks step consecutivi e restituisce le statistiche di esecuzione
+    def run(self, ticks, dt=1/60):
+        start = time.perf_counter()
+        for _ in range(ticks):
+            self.step(dt)
+        elapsed = time.perf_counter() - start
+
+        agent_steps = ticks * len(self.agents)
+        return {
+            'ticks': ticks,
+            'agents': len(self.agents),
+            'agent_steps': agent_steps,
+            'sim_time': ticks * dt,
+            'wall_time': elapsed,
+            'agent_steps_per_sec': agent_steps / elapsed if elapsed > 0 else math.inf,
+            'sim_rate': ticks * dt / elapsed if elapsed > 0 else math.inf, # secondi simulati per secondo reale
+            'completed_trips': self.completed_trips,
+            'routing': self.router.stats() if self.router is not None else None,
+        }
+
+    # Lunghezza delle code per ogni semaforo: {nodo: {arco entrante: agenti}}
+    def queue_lengths(self):
+        return {node: tl.queue_lengths() for node, tl in self.traffic_lights.items()}
+
+    # Pubblica lo stato degli agenti e le code ai semafori per le finestre tkinter
+    def publish_agents(self):
+        queue_lengths = self.queue_lengths()
+        with self.lock:
+            self.shared_data["queue_lengths"] = queue_lengths
+            for agent in self.agents:
+                self.shared_data["agents"][agent] = {
+                    'direction': round(math.degrees(agent.angle), 2),
+                    'speed': round(agent.actual_speed, 2),
+                    'current_edge': agent.current_edge(),
+                    'path': agent.path,
+                    'coords': (round(agent.x, 2), round(agent.y, 2)),
+                    'actual_speed': round(agent.actual_speed, 2)
+                }
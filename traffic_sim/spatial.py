@@ -0,0 +1,126 @@
+import numpy as np
+
+from utilities.Debug import debug
+
+DEBUG = False
+
+# Celle coperte (per asse) oltre le quali un elemento non viene inserito nella griglia
+MAX_CELL_SPAN = 4
+
+# Indice spaziale a griglia uniforme sui rettangoli di ingombro (min_x, min_y, max_x, max_y)
+class SpatialGrid:
+    """
+    La dimensione delle celle è scelta in modo da avere circa una cella per
+    elemento. Ogni elemento è registrato in tutte le celle toccate dal suo
+    rettangolo; quelli che coprono più di MAX_CELL_SPAN celle per lato (archi
+    lunghi nei layout a forze) restano in una lista a parte, controllata con un
+    unico test vettoriale a ogni interrogazione. Le celle sono in formato CSR:
+    indici degli elementi ordinati per cella più l'inizio di ogni cella.
+    """
+    def __init__(self, boxes):
+        self.boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        n = len(self.boxes)
+        if n == 0:
+            self.origin = np.zeros(2)
+            self.cell = 1.0
+            self.nx = self.ny = 1
+            self.cell_start = np.zeros(2, dtype=np.int64)
+            self.cell_items = np.zeros(0, dtype=np.int64)
+            self.large = np.zeros(0, dtype=np.int64)
+            return
+        low = self.boxes[:, :2].min(axis=0)
+        high = self.boxes[:, 2:].max(axis=0)
+        extent = np.maximum(high - low, 1e-9)
+        self.origin = low
+        self.cell = max(float(np.sqrt(extent[0] * extent[1] / n)), float(extent.max()) / 1024, 1e-9)
+        self.nx = int(extent[0] // self.cell) + 1
+        self.ny = int(extent[1] // self.cell) + 1
+
+        x0, y0, x1, y1 = self._cell_range(self.boxes)
+        span_x = x1 - x0 + 1
+        span_y = y1 - y0 + 1
+        small = (span_x <= MAX_CELL_SPAN) & (span_y <= MAX_CELL_SPAN)
+        self.large = np.flatnonzero(~small)
+
+        # una voce per ogni (elemento, cella coperta)
+        items = np.flatnonzero(small)
+        span_x, span_y, x0, y0 = span_x[items], span_y[items], x0[items], y0[items]
+        count = span_x * span_y
+        first = np.cumsum(count) - count
+        k = np.arange(int(count.sum())) - np.repeat(first, count)
+        span_x = np.repeat(span_x, count)
+        cells = (np.repeat(x0, count) + k % span_x) * self.ny + np.repeat(y0, count) + k // span_x
+        order = np.argsort(cells, kind="stable")
+        self.cell_items = np.repeat(items, count)[order]
+        self.cell_start = np.zeros(self.nx * self.ny + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cells, minlength=self.nx * self.ny), out=self.cell_start[1:])
+        if DEBUG:
+            debug(f"SpatialGrid: {n} elementi, {self.nx}x{self.ny} celle, {len(self.large)} fuori griglia")
+
+    # Intervallo di celle (inclusivo) coperto da ogni rettangolo
+    def _cell_range(self, boxes):
+        lo = np.floor((boxes[:, :2] - self.origin) / self.cell).astype(np.int64)
+        hi = np.floor((boxes[:, 2:] - self.origin) / self.cell).astype(np.int64)
+        lo[:, 0] = np.clip(lo[:, 0], 0, self.nx - 1)
+        hi[:, 0] = np.clip(hi[:, 0], 0, self.nx - 1)
+        lo[:, 1] = np.clip(lo[:, 1], 0, self.ny - 1)
+        hi[:, 1] = np.clip(hi[:, 1], 0, self.ny - 1)
+        return lo[:, 0], lo[:, 1], hi[:, 0], hi[:, 1]
+
+    # Indici (crescenti) degli elementi il cui rettangolo interseca quello dato
+    def query(self, min_x, min_y, max_x, max_y):
+        boxes = self.boxes
+        if len(boxes) == 0:
+            return np.zeros(0, dtype=np.int64)
+        high = self.origin + (self.nx * self.cell, self.ny * self.cell)
+        if max_x < self.origin[0] or max_y < self.origin[1] or min_x > high[0] or min_y > high[1]:
+            return np.zeros(0, dtype=np.int64)
+
+        x0, y0, x1, y1 = (int(c[0]) for c in self._cell_range(np.array([[min_x, min_y, max_x, max_y]])))
+        if (x1 - x0 + 1) * (y1 - y0 + 1) * 4 >= self.nx * self.ny:
+            # la vista copre buona parte della griglia: test diretto su tutti gli elementi
+            candidates = np.arange(len(boxes))
+        else:
+            start = self.cell_start
+            # per ogni colonna le celle y0..y1 sono contigue nel CSR
+            parts = [self.cell_items[start[cx * self.ny + y0]:start[cx * self.ny + y1 + 1]] for cx in range(x0, x1 + 1)]
+            parts.append(self.large)
+            candidates = np.unique(np.concatenate(parts))
+        b = boxes[candidates]
+        inside = (b[:, 0] <= max_x) & (b[:, 2] >= min_x) & (b[:, 1] <= max_y) & (b[:, 3] >= min_y)
+        return candidates[inside]
+
+# Indice spaziale di nodi e archi di un grafo, nell'ordine di G.nodes e G.edges
+class NetworkIndex:
+    def __init__(self, G, pos):
+        self.nodes = list(G.nodes)
+        self.edges = list(G.edges)
+        node_xy = np.array([pos[n] for n in self.nodes], dtype=np.float64).reshape(-1, 2)
+        self.node_grid = SpatialGrid(np.hstack((node_xy, node_xy)))
+        index = {n: i for i, n in enumerate(self.nodes)}
+        ends = np.array([(index[u], index[v]) for u, v in self.edges], dtype=np.int64).reshape(-1, 2)
+        p1 = node_xy[ends[:, 0]]
+        p2 = node_xy[ends[:, 1]]
+        self.edge_grid = SpatialGrid(np.hstack((np.minimum(p1, p2), np.maximum(p1, p2))))
+
+    # Nodi dentro il rettangolo (in coordinate del mondo)
+    def nodes_in(self, min_x, min_y, max_x, max_y):
+        nodes = self.nodes
+        return [nodes[i] for i in self.node_grid.query(min_x, min_y, max_x, max_y).tolist()]
+
+    # Archi il cui segmento può attraversare il rettangolo (test sul rettangolo di ingombro)
+    def edges_in(self, min_x, min_y, max_x, max_y):
+        edges = self.edges
+        return [edges[i] for i in self.edge_grid.query(min_x, min_y, max_x, max_y).tolist()]
+
+# Righe vive dello store con l'agente dentro il rettangolo
+def agent_rows_in(store, min_x, min_y, max_x, max_y):
+    """
+    Le posizioni degli agenti cambiano a ogni step: invece di ricostruire un
+    indice per frame basta un test vettoriale sulle colonne x, y dello store,
+    che costa meno dell'ordinamento per cella.
+    """
+    n = store.size
+    x = store.x[:n]
+    y = store.y[:n]
+    return np.flatnonzero(store.alive[:n] & (x >= min_x) & (x <= max_x) & (y >= min_y) & (y <= max_y))
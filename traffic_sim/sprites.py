@@ -0,0 +1,73 @@
+import math
+import numpy as np
+import pygame
+
+from utilities.Debug import debug
+
+DEBUG = False
+
+# Numero di direzioni in cui è pre-ruotato il triangolo dell'agente
+ANGLE_BUCKETS = 64
+
+# Pixel totali massimi delle sprite tenute in memoria (oltre questa soglia l'atlante viene svuotato)
+SPRITE_CACHE_PIXELS = 8_000_000
+
+# Atlante delle sprite degli agenti: triangolo pre-ruotato per (colore, raggio sullo schermo, direzione)
+class AgentSprites:
+    """
+    Il triangolo disegnato da Agent.draw è renderizzato una volta per ogni
+    combinazione di colore, raggio in pixel (che dipende dallo zoom) e fascia
+    di angolo, su una superficie con colorkey; a ogni frame gli agenti sono
+    copiati sullo schermo con un'unica chiamata a Surface.blits. Le sprite sono
+    create al primo uso: i colori degli agenti sono casuali, quindi l'atlante
+    completo non starebbe in memoria. Quando le sprite superano
+    SPRITE_CACHE_PIXELS (di solito dopo molti cambi di zoom) l'atlante viene
+    svuotato e ricostruito con quelle in uso; niente contabilità LRU, che a ogni
+    frame costerebbe più delle copie stesse.
+    """
+    def __init__(self, buckets=ANGLE_BUCKETS, max_pixels=SPRITE_CACHE_PIXELS):
+        self.buckets = buckets
+        self.max_pixels = max_pixels
+        self.sprites = {} # (colore, raggio, fascia) -> superficie
+        self.pixels = 0
+
+    # Fascia di angolo più vicina per ogni angolo (in radianti)
+    def angle_bucket(self, angle):
+        return np.rint(np.asarray(angle) * (self.buckets / (2 * math.pi))).astype(np.int64) % self.buckets
+
+    # Sprite centrata nel punto (2 * radius + 1, 2 * radius + 1) della superficie
+    def get(self, color, radius, bucket):
+        key = (color, radius, bucket)
+        sprite = self.sprites.get(key)
+        if sprite is None:
+            sprite = self._render(color, radius, bucket)
+            size = sprite.get_width() * sprite.get_height()
+            if self.pixels + size > self.max_pixels:
+                self.clear()
+            self.sprites[key] = sprite
+            self.pixels += size
+        return sprite
+
+    # Stessa forma di Agent.draw, ruotata dell'angolo centrale della fascia
+    def _render(self, color, radius, bucket):
+        c = 2 * radius + 1
+        angle = bucket * (2 * math.pi / self.buckets)
+        cos_a = math.cos(angle)
+        sin_a = math.sin(angle)
+        base_shape = [(radius*2, 0), (-radius, radius), (-radius, -radius)]
+        rotated = [(x * cos_a - y * sin_a + c, x * sin_a + y * cos_a + c) for x, y in base_shape]
+
+        key_color = (255, 0, 255) if tuple(color) != (255, 0, 255) else (0, 255, 0)
+        sprite = pygame.Surface((2 * c + 1, 2 * c + 1))
+        sprite.fill(key_color)
+        pygame.draw.polygon(sprite, color, rotated)
+        sprite.set_colorkey(key_color, pygame.RLEACCEL)
+        return sprite
+
+    def clear(self):
+        if DEBUG:
+            debug(f"atlante agenti svuotato: {len(self.sprites)} sprite, {self.pixels} pixel")
+        self.sprites.clear()
+        self.pixels = 0
+
+agent_sprites = AgentSprites()
@@ -0,0 +1,79 @@
+import time
+
+from utilities.Debug import debug
+
+DEBUG = False
+
+# Passo fisso di simulazione in secondi simulati
+STEP_DT = 1 / 60
+
+# Massimo numero di sotto-step per frame: oltre, il tempo arretrato viene scartato
+MAX_SUBSTEPS = 32
+
+# Intervallo (secondi reali) su cui viene misurato il rapporto tempo simulato / tempo reale
+RATE_WINDOW = 0.5
+
+# Avanzamento a passo fisso della simulazione, indipendente dal frame rate
+class FixedStepScheduler:
+    """
+    Il tempo reale di ogni frame, moltiplicato per la velocità di simulazione,
+    si accumula in un serbatoio da cui vengono consumati step di durata fissa
+    step_dt: a velocità 10x si eseguono più sotto-step per frame invece di un
+    unico step dieci volte più lungo, quindi gli agenti non superano i target.
+    In modalità turbo si eseguono step finché non scade il budget di tempo
+    reale del frame, senza alcun limite di velocità.
+    """
+    def __init__(self, sim, step_dt=STEP_DT, max_substeps=MAX_SUBSTEPS):
+        self.sim = sim
+        self.step_dt = step_dt
+        self.max_substeps = max_substeps
+        self.accumulator = 0.0 # tempo simulato ancora da eseguire
+        self.dropped_time = 0.0 # tempo simulato scartato perché la CPU non tiene il passo
+
+        self._window_start = time.perf_counter()
+        self._window_sim_time = 0.0
+        self.sim_rate = 0.0 # secondi simulati per secondo reale (ultima finestra)
+
+    # Esegue i sotto-step corrispondenti a wall_dt secondi reali alla velocità speed
+    def advance(self, wall_dt, speed=1.0):
+        self.accumulator += wall_dt * speed
+        substeps = int(self.accumulator / self.step_dt)
+        if substeps > self.max_substeps:
+            # evita la spirale in cui ogni frame accumula più lavoro di quanto ne esegue
+            self.dropped_time += (substeps - self.max_substeps) * self.step_dt
+            substeps = self.max_substeps
+            self.accumulator = self.accumulator % self.step_dt
+        else:
+            self.accumulator -= substeps * self.step_dt
+        for _ in range(substeps):
+            self.sim.step(self.step_dt)
+        self._track(substeps)
+        return substeps
+
+    # Esegue step fino a esaurire wall_budget secondi reali (almeno uno)
+    def turbo(self, wall_budget):
+        self.accumulator = 0.0
+        deadline = time.perf_counter() + wall_budget
+        substeps = 0
+        while True:
+            self.sim.step(self.step_dt)
+            substeps += 1
+            if time.perf_counter() >= deadline:
+                break
+        self._track(substeps)
+        return substeps
+
+    # Frazione di step non ancora eseguita (per interpolare il disegno)
+    def alpha(self):
+        return self.accumulator / self.step_dt
+
+    def _track(self, substeps):
+        self._window_sim_time += substeps * self.step_dt
+        now = time.perf_counter()
+        elapsed = now - self._window_start
+        if elapsed >= RATE_WINDOW:
+            self.sim_rate = self._window_sim_time / elapsed
+            self._window_start = now
+            self._window_sim_time = 0.0
+            if DEBUG:
+                debug(f"sim x{self.sim_rate:.2f}, tempo scartato {self.dropped_time:.2f} s")